@@ -7,10 +7,15 @@ AES.py
 """
 
 import sys
+import struct
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from cryptography_utilities import (right_pad, left_pad,
     decimal_to_binary, binary_to_decimal, string_to_binary,
-    file_to_binary, binary_to_file, bitwise_xor, pad_plaintext,
-    unpad_plaintext, block_split, rotate)
+    bitwise_xor, rotate, bytes_to_binary,
+    binary_to_bytes, pad_bytes, unpad_bytes, rotate_word_right,
+    bytes_xor, bytes_to_int, word_mask, chunked_file_transform,
+    run_pipeline, CHUNK_BYTES, LRUCache)
 
 S_BOX = [['0x63', '0x7C', '0x77', '0x7B', '0xF2', '0x6B', '0x6F', '0xC5',
           '0x30', '0x01', '0x67', '0x2B', '0xFE', '0xD7', '0xAB', '0x76'],
@@ -92,6 +97,71 @@ NUMBER_OF_ROUNDS = 11
 
 MATRIX_SIZE = 4
 
+BLOCK_BYTES = 16
+
+CTR_CHUNK_BYTES = 2**20
+
+GCM_NONCE_BYTES = 12
+
+GCM_COUNTER_BITS = 32
+
+KEY_CACHE_SIZE = 64
+
+def xtime(byte):
+    """Multiply an integer byte by X in the GF(2^8) finite field."""
+    byte <<= 1
+    return byte ^ 0x11B if byte & 0x100 else byte
+
+def gf_mult(byte1, byte2):
+    """Multiply two integer bytes in the GF(2^8) finite field."""
+    product = 0
+    while byte2:
+        if byte2 & 1:
+            product ^= byte1
+        byte1 = xtime(byte1)
+        byte2 >>= 1
+    return product
+
+def table_column(s_box_value, multipliers):
+    """Pack the GF(2^8) products of an s-box output and a MixColumns
+    column into a single 32-bit word.
+    """
+    return reduce(lambda word, multiplier:
+                      (word << 8) | gf_mult(s_box_value, multiplier),
+                  multipliers, 0)
+
+SUB_BYTES = [int(value, 16) for row in S_BOX for value in row]
+
+INVERSE_SUB_BYTES = [int(value, 16) for row in INVERSE_S_BOX for value in row]
+
+# Te0 combines SubBytes and the first MixColumns column; Te1-Te3 are
+# the same table rotated a byte at a time, one per ShiftRows offset.
+TE0 = [table_column(value, [2, 1, 1, 3]) for value in SUB_BYTES]
+TE1, TE2, TE3 = [[rotate_word_right(word, 8 * shift) for word in TE0]
+                 for shift in [1, 2, 3]]
+
+TD0 = [table_column(value, [14, 9, 13, 11]) for value in INVERSE_SUB_BYTES]
+TD1, TD2, TD3 = [[rotate_word_right(word, 8 * shift) for word in TD0]
+                 for shift in [1, 2, 3]]
+
+# Lookup arrays for the vectorized (many blocks at once) NumPy path.
+S_BOX_ARRAY = np.array(SUB_BYTES, dtype=np.uint8)
+
+INVERSE_S_BOX_ARRAY = np.array(INVERSE_SUB_BYTES, dtype=np.uint8)
+
+XTIME_ARRAY = np.array([xtime(byte) for byte in xrange(256)], dtype=np.uint8)
+
+INVERSE_MIX_ARRAYS = [np.array([gf_mult(byte, multiplier)
+                                for byte in xrange(256)], dtype=np.uint8)
+                      for multiplier in [14, 11, 13, 9]]
+
+# Byte 4c + r of a block is row r, column c of the state matrix.
+SHIFT_ROWS_INDEXES = [row + 4 * ((column + row) % 4)
+                      for column in xrange(4) for row in xrange(4)]
+
+INVERSE_SHIFT_ROWS_INDEXES = [row + 4 * ((column - row) % 4)
+                              for column in xrange(4) for row in xrange(4)]
+
 def apply_s_box(eight_bits, s_box):
     """Index into an s-box. Row is determined by the first four bits,
     column by the second four bits.
@@ -211,6 +281,119 @@ def key_schedule(key):
     return [rotate_matrix(key_columns[index:index + MATRIX_SIZE])
             for index in xrange(0, number_of_columns, MATRIX_SIZE)]
 
+def expand_key(key):
+    """Integer counterpart to key_schedule. Take a 16 byte key and
+    evaluate to a list of 44 32-bit round key words, four per round.
+    Like key_schedule, the key's bytes are read row-wise and the round
+    constant starts at 00000010.
+    """
+    key_bytes = bytearray(key)
+    words = [(key_bytes[row] << 24 | key_bytes[row + 4] << 16 |
+              key_bytes[row + 8] << 8 | key_bytes[row + 12])
+             for row in xrange(MATRIX_SIZE)]
+    constant = 1
+    for column_number in xrange(MATRIX_SIZE, MATRIX_SIZE * NUMBER_OF_ROUNDS):
+        word = words[column_number - 1]
+        if column_number % 4 == 0:
+            constant = xtime(constant)
+            word = ((SUB_BYTES[(word >> 16) & 0xFF] ^ constant) << 24 |
+                    SUB_BYTES[(word >> 8) & 0xFF] << 16 |
+                    SUB_BYTES[word & 0xFF] << 8 |
+                    SUB_BYTES[word >> 24])
+        words.append(words[column_number - 4] ^ word)
+    return words
+
+def inverse_mix_word(word):
+    """Apply InvMixColumns to a single round key word."""
+    return (TD0[SUB_BYTES[word >> 24]] ^
+            TD1[SUB_BYTES[(word >> 16) & 0xFF]] ^
+            TD2[SUB_BYTES[(word >> 8) & 0xFF]] ^
+            TD3[SUB_BYTES[word & 0xFF]])
+
+def invert_key_schedule(round_keys):
+    """Convert expand_key output into round key words for the
+    equivalent inverse cipher: rounds reversed and the inner ones
+    passed through InvMixColumns.
+    """
+    rounds = [round_keys[index:index + MATRIX_SIZE]
+              for index in xrange(0, len(round_keys), MATRIX_SIZE)]
+    rounds.reverse()
+    inverse_keys = list(rounds[0])
+    for round_words in rounds[1:-1]:
+        inverse_keys.extend(inverse_mix_word(word) for word in round_words)
+    inverse_keys.extend(rounds[-1])
+    return inverse_keys
+
+def encrypt_words(s0, s1, s2, s3, round_keys):
+    """Encrypt one block, given as four 32-bit column words, with the
+    T-tables. Evaluates to a tuple of four words.
+    """
+    s0 ^= round_keys[0]
+    s1 ^= round_keys[1]
+    s2 ^= round_keys[2]
+    s3 ^= round_keys[3]
+    for index in xrange(4, 4 * (NUMBER_OF_ROUNDS - 1), 4):
+        s0, s1, s2, s3 = (
+            TE0[s0 >> 24] ^ TE1[(s1 >> 16) & 0xFF] ^
+            TE2[(s2 >> 8) & 0xFF] ^ TE3[s3 & 0xFF] ^ round_keys[index],
+            TE0[s1 >> 24] ^ TE1[(s2 >> 16) & 0xFF] ^
+            TE2[(s3 >> 8) & 0xFF] ^ TE3[s0 & 0xFF] ^ round_keys[index + 1],
+            TE0[s2 >> 24] ^ TE1[(s3 >> 16) & 0xFF] ^
+            TE2[(s0 >> 8) & 0xFF] ^ TE3[s1 & 0xFF] ^ round_keys[index + 2],
+            TE0[s3 >> 24] ^ TE1[(s0 >> 16) & 0xFF] ^
+            TE2[(s1 >> 8) & 0xFF] ^ TE3[s2 & 0xFF] ^ round_keys[index + 3])
+    s = SUB_BYTES
+    return (
+        (s[s0 >> 24] << 24 | s[(s1 >> 16) & 0xFF] << 16 |
+         s[(s2 >> 8) & 0xFF] << 8 | s[s3 & 0xFF]) ^ round_keys[-4],
+        (s[s1 >> 24] << 24 | s[(s2 >> 16) & 0xFF] << 16 |
+         s[(s3 >> 8) & 0xFF] << 8 | s[s0 & 0xFF]) ^ round_keys[-3],
+        (s[s2 >> 24] << 24 | s[(s3 >> 16) & 0xFF] << 16 |
+         s[(s0 >> 8) & 0xFF] << 8 | s[s1 & 0xFF]) ^ round_keys[-2],
+        (s[s3 >> 24] << 24 | s[(s0 >> 16) & 0xFF] << 16 |
+         s[(s1 >> 8) & 0xFF] << 8 | s[s2 & 0xFF]) ^ round_keys[-1])
+
+def decrypt_words(s0, s1, s2, s3, inverse_keys):
+    """Decrypt one block of four 32-bit column words with the inverse
+    T-tables. The keys must come from invert_key_schedule.
+    """
+    s0 ^= inverse_keys[0]
+    s1 ^= inverse_keys[1]
+    s2 ^= inverse_keys[2]
+    s3 ^= inverse_keys[3]
+    for index in xrange(4, 4 * (NUMBER_OF_ROUNDS - 1), 4):
+        s0, s1, s2, s3 = (
+            TD0[s0 >> 24] ^ TD1[(s3 >> 16) & 0xFF] ^
+            TD2[(s2 >> 8) & 0xFF] ^ TD3[s1 & 0xFF] ^ inverse_keys[index],
+            TD0[s1 >> 24] ^ TD1[(s0 >> 16) & 0xFF] ^
+            TD2[(s3 >> 8) & 0xFF] ^ TD3[s2 & 0xFF] ^ inverse_keys[index + 1],
+            TD0[s2 >> 24] ^ TD1[(s1 >> 16) & 0xFF] ^
+            TD2[(s0 >> 8) & 0xFF] ^ TD3[s3 & 0xFF] ^ inverse_keys[index + 2],
+            TD0[s3 >> 24] ^ TD1[(s2 >> 16) & 0xFF] ^
+            TD2[(s1 >> 8) & 0xFF] ^ TD3[s0 & 0xFF] ^ inverse_keys[index + 3])
+    s = INVERSE_SUB_BYTES
+    return (
+        (s[s0 >> 24] << 24 | s[(s3 >> 16) & 0xFF] << 16 |
+         s[(s2 >> 8) & 0xFF] << 8 | s[s1 & 0xFF]) ^ inverse_keys[-4],
+        (s[s1 >> 24] << 24 | s[(s0 >> 16) & 0xFF] << 16 |
+         s[(s3 >> 8) & 0xFF] << 8 | s[s2 & 0xFF]) ^ inverse_keys[-3],
+        (s[s2 >> 24] << 24 | s[(s1 >> 16) & 0xFF] << 16 |
+         s[(s0 >> 8) & 0xFF] << 8 | s[s3 & 0xFF]) ^ inverse_keys[-2],
+        (s[s3 >> 24] << 24 | s[(s2 >> 16) & 0xFF] << 16 |
+         s[(s1 >> 8) & 0xFF] << 8 | s[s0 & 0xFF]) ^ inverse_keys[-1])
+
+def process_blocks(data, block_fn, round_keys):
+    """Run block_fn over every 16 byte block of a byte string. The
+    whole input is unpacked into words once, rather than per block.
+    """
+    words = struct.unpack('>%dI' % (len(data) // 4), data)
+    output = []
+    extend = output.extend
+    for index in xrange(0, len(words), 4):
+        extend(block_fn(words[index], words[index + 1],
+                        words[index + 2], words[index + 3], round_keys))
+    return struct.pack('>%dI' % len(output), *output)
+
 def format_key(key, key_length=128):
     """Appropriately convert a string key into a certain bit length.
     Oversized keys are truncated, undersized keys are padded with zeroes.
@@ -221,55 +404,286 @@ def format_key(key, key_length=128):
     else:
         return binary_key[:key_length]
 
+def round_key_array(round_keys):
+    """Convert round key words into an (11, 16) uint8 array, one row
+    of bytes per round.
+    """
+    packed = struct.pack('>%dI' % len(round_keys), *round_keys)
+    return np.frombuffer(packed, dtype=np.uint8).reshape(-1, BLOCK_BYTES)
+
+def mix_columns_array(state):
+    """MixColumns on an (n, 4, 4) array of columns, using the identity
+    b_r = a_r ^ (a_0 ^ a_1 ^ a_2 ^ a_3) ^ xtime(a_r ^ a_{r+1}).
+    """
+    total = np.bitwise_xor.reduce(state, axis=2)[:, :, np.newaxis]
+    return state ^ total ^ XTIME_ARRAY[state ^ np.roll(state, -1, axis=2)]
+
+def inverse_mix_columns_array(state):
+    """InvMixColumns on an (n, 4, 4) array of columns."""
+    result = INVERSE_MIX_ARRAYS[0][state]
+    for offset in xrange(1, 4):
+        result ^= INVERSE_MIX_ARRAYS[offset][np.roll(state, -offset, axis=2)]
+    return result
+
+def encrypt_block_array(blocks, round_keys):
+    """Encrypt an (n, 16) uint8 array of blocks given a round_key_array,
+    running every round on all n blocks at once.
+    """
+    state = np.asarray(blocks, dtype=np.uint8) ^ round_keys[0]
+    for round in xrange(1, NUMBER_OF_ROUNDS - 1):
+        state = S_BOX_ARRAY[state][:, SHIFT_ROWS_INDEXES]
+        state = mix_columns_array(state.reshape(-1, 4, 4))
+        state = state.reshape(-1, BLOCK_BYTES) ^ round_keys[round]
+    state = S_BOX_ARRAY[state][:, SHIFT_ROWS_INDEXES]
+    return state ^ round_keys[-1]
+
+def decrypt_block_array(blocks, round_keys):
+    """Decrypt an (n, 16) uint8 array of blocks given a round_key_array."""
+    state = np.asarray(blocks, dtype=np.uint8) ^ round_keys[-1]
+    for round in xrange(NUMBER_OF_ROUNDS - 2, 0, -1):
+        state = INVERSE_S_BOX_ARRAY[state[:, INVERSE_SHIFT_ROWS_INDEXES]]
+        state = state ^ round_keys[round]
+        state = inverse_mix_columns_array(state.reshape(-1, 4, 4))
+        state = state.reshape(-1, BLOCK_BYTES)
+    state = INVERSE_S_BOX_ARRAY[state[:, INVERSE_SHIFT_ROWS_INDEXES]]
+    return state ^ round_keys[0]
+
+def encrypt_blocks(blocks, key):
+    """Encrypt an (n, 16) uint8 array of blocks with AES (no padding).
+    The Python overhead is paid per round rather than per block.
+    """
+    return encrypt_block_array(blocks, aes_key(key).round_key_array)
+
+def decrypt_blocks(blocks, key):
+    """Decrypt an (n, 16) uint8 array of blocks with AES (no padding)."""
+    return decrypt_block_array(blocks, aes_key(key).round_key_array)
+
+def counter_keystream(round_keys, initial_counter, counter_bits,
+                      first_block, number_of_blocks):
+    """Encrypt a run of counter blocks. Only the low counter_bits of
+    the 128-bit initial counter are incremented (and wrap), so every
+    block can be produced independently of the others.
+    """
+    mask = word_mask(counter_bits)
+    prefix = initial_counter & ~mask
+    counters = []
+    for block_number in xrange(first_block, first_block + number_of_blocks):
+        counter = prefix | ((initial_counter + block_number) & mask)
+        counters.extend((counter >> 96, (counter >> 64) & 0xFFFFFFFF,
+                         (counter >> 32) & 0xFFFFFFFF, counter & 0xFFFFFFFF))
+    blocks = np.frombuffer(struct.pack('>%dI' % len(counters), *counters),
+                           dtype=np.uint8).reshape(-1, BLOCK_BYTES)
+    return encrypt_block_array(blocks, round_key_array(round_keys)).tobytes()
+
+def counter_transform(data, round_keys, initial_counter, counter_bits,
+                      offset=0):
+    """XOR data with the keystream as if data began offset bytes into
+    the message. Only the blocks that overlap data are generated.
+    """
+    if not data:
+        return data
+    first_block, skip = divmod(offset, BLOCK_BYTES)
+    number_of_blocks = -(-(skip + len(data)) // BLOCK_BYTES)
+    keystream = counter_keystream(round_keys, initial_counter, counter_bits,
+                                  first_block, number_of_blocks)
+    return bytes_xor(data, keystream[skip:skip + len(data)])
+
+def parallel_counter_transform(data, round_keys, initial_counter,
+                               counter_bits, offset=0, workers=None,
+                               chunk_size=CTR_CHUNK_BYTES):
+    """counter_transform split into chunk_size pieces and spread across
+    a pool of worker processes.
+    """
+    starts = range(0, len(data), chunk_size)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(counter_transform,
+                                   data[start:start + chunk_size],
+                                   round_keys, initial_counter,
+                                   counter_bits, offset + start)
+                   for start in starts]
+        return b''.join(future.result() for future in futures)
+
+class AESKey(object):
+    """An expanded AES key. The encryption and decryption (inverse
+    mixed) round keys are computed once and kept as integer tuples, so
+    the object can be reused for any number of messages.
+    """
+
+    def __init__(self, key):
+        """Expand a 16 byte key."""
+        if len(key) != BLOCK_BYTES:
+            raise ValueError("AES keys must be 16 bytes.")
+        self.key = bytes(key)
+        round_keys = expand_key(key)
+        self.round_keys = tuple(round_keys)
+        self.inverse_keys = tuple(invert_key_schedule(round_keys))
+        self.round_key_array = round_key_array(round_keys)
+
+    def encrypt(self, plaintext):
+        """Generate padded ciphertext bytes from plaintext bytes."""
+        return process_blocks(pad_bytes(plaintext, BLOCK_BYTES),
+                              encrypt_words, self.round_keys)
+
+    def decrypt(self, ciphertext):
+        """Reveal plaintext bytes from ciphertext bytes."""
+        return unpad_bytes(process_blocks(ciphertext, decrypt_words,
+                                          self.inverse_keys))
+
+    def encrypt_cbc(self, plaintext, iv):
+        """Encrypt plaintext bytes in cipher block chaining mode. The iv
+        should be 16 bytes.
+        """
+        round_keys = self.round_keys
+        padded = pad_bytes(plaintext, BLOCK_BYTES)
+        words = struct.unpack('>%dI' % (len(padded) // 4), padded)
+        c0, c1, c2, c3 = struct.unpack('>4I', iv)
+        output = []
+        for index in xrange(0, len(words), 4):
+            c0, c1, c2, c3 = encrypt_words(words[index] ^ c0,
+                                           words[index + 1] ^ c1,
+                                           words[index + 2] ^ c2,
+                                           words[index + 3] ^ c3,
+                                           round_keys)
+            output.extend((c0, c1, c2, c3))
+        return struct.pack('>%dI' % len(output), *output)
+
+    def decrypt_cbc(self, ciphertext, iv):
+        """Reveal plaintext bytes from cipher block chaining ciphertext."""
+        inverse_keys = self.inverse_keys
+        words = struct.unpack('>%dI' % (len(ciphertext) // 4), ciphertext)
+        c0, c1, c2, c3 = struct.unpack('>4I', iv)
+        output = []
+        for index in xrange(0, len(words), 4):
+            block = words[index:index + 4]
+            p0, p1, p2, p3 = decrypt_words(block[0], block[1], block[2],
+                                           block[3], inverse_keys)
+            output.extend((p0 ^ c0, p1 ^ c1, p2 ^ c2, p3 ^ c3))
+            c0, c1, c2, c3 = block
+        return unpad_bytes(struct.pack('>%dI' % len(output), *output))
+
+    def counter_crypt(self, data, initial_counter, counter_bits,
+                      offset=0, workers=1):
+        """Run counter_transform, in worker processes if workers > 1."""
+        if workers == 1:
+            return counter_transform(data, self.round_keys, initial_counter,
+                                     counter_bits, offset)
+        return parallel_counter_transform(data, self.round_keys,
+                                          initial_counter, counter_bits,
+                                          offset, workers)
+
+    def ctr_crypt(self, data, iv, offset=0, workers=1):
+        """Encrypt or decrypt bytes in counter mode. See ctr_crypt."""
+        return self.counter_crypt(data, bytes_to_int(iv), 8 * BLOCK_BYTES,
+                                  offset, workers)
+
+    def gcm_counter_crypt(self, data, nonce, offset=0, workers=1):
+        """Encrypt or decrypt bytes with the GCM style counter. See
+        gcm_counter_crypt.
+        """
+        if len(nonce) != GCM_NONCE_BYTES:
+            raise ValueError("GCM counter mode needs a 12 byte nonce.")
+        initial_counter = (bytes_to_int(nonce) << GCM_COUNTER_BITS) | 2
+        return self.counter_crypt(data, initial_counter, GCM_COUNTER_BITS,
+                                  offset, workers)
+
+KEY_CACHE = LRUCache(KEY_CACHE_SIZE)
+
+def aes_key(key):
+    """Find the AESKey for a 16 byte key, expanding it only if it isn't
+    among the KEY_CACHE_SIZE most recently used keys.
+    """
+    return KEY_CACHE.get(bytes(key), AESKey)
+
+def encrypt_bytes(plaintext, key):
+    """Generate ciphertext bytes from plaintext bytes with AES. The key
+    should be 16 bytes.
+    """
+    return aes_key(key).encrypt(plaintext)
+
+def decrypt_bytes(ciphertext, key):
+    """Reveal plaintext bytes from ciphertext bytes with AES."""
+    return aes_key(key).decrypt(ciphertext)
+
+def encrypt_cbc(plaintext, key, iv):
+    """Encrypt plaintext bytes with AES in cipher block chaining mode.
+    The key and iv should both be 16 bytes.
+    """
+    return aes_key(key).encrypt_cbc(plaintext, iv)
+
+def decrypt_cbc(ciphertext, key, iv):
+    """Reveal plaintext bytes from AES cipher block chaining ciphertext."""
+    return aes_key(key).decrypt_cbc(ciphertext, iv)
+
+def ctr_crypt(data, key, iv, offset=0, workers=1):
+    """Encrypt or decrypt bytes with AES in counter mode. The 16 byte iv
+    is the first counter block, incremented mod 2^128. A nonzero offset
+    treats data as the slice starting that many bytes into the message,
+    and workers > 1 generates the keystream in separate processes.
+    """
+    return aes_key(key).ctr_crypt(data, iv, offset, workers)
+
+def ctr_decrypt_range(ciphertext, key, iv, start, end):
+    """Decrypt only bytes start..end of a counter mode ciphertext."""
+    return ctr_crypt(ciphertext[start:end], key, iv, offset=start)
+
+def gcm_counter_crypt(data, key, nonce, offset=0, workers=1):
+    """Encrypt or decrypt bytes with the GCM style counter: a 12 byte
+    nonce followed by a 32-bit block counter that starts at 2. No
+    authentication tag is computed.
+    """
+    return aes_key(key).gcm_counter_crypt(data, nonce, offset, workers)
+
+def chunk_transform(key, decrypt=False):
+    """Evaluate to a transform(chunk, is_last) function that encrypts
+    (or decrypts) a message chunk by chunk. Chunks must be a multiple
+    of 16 bytes; only the last one is padded or unpadded.
+    """
+    context = aes_key(key)
+
+    def transform(chunk, is_last):
+        if decrypt:
+            if is_last:
+                return context.decrypt(chunk)
+            return process_blocks(chunk, decrypt_words, context.inverse_keys)
+        if is_last:
+            return context.encrypt(memoryview(chunk).tobytes())
+        return process_blocks(chunk, encrypt_words, context.round_keys)
+    return transform
+
+def encrypt_file(input_path, output_path, key, chunk_size=CHUNK_BYTES):
+    """Encrypt a file with AES chunk by chunk. Only the last chunk is
+    padded, so the output matches encrypt_bytes on the whole file.
+    """
+    chunked_file_transform(input_path, output_path, chunk_transform(key),
+                           chunk_size - chunk_size % BLOCK_BYTES)
+
+def decrypt_file(input_path, output_path, key, chunk_size=CHUNK_BYTES):
+    """Decrypt an AES encrypted file chunk by chunk."""
+    chunked_file_transform(input_path, output_path,
+                           chunk_transform(key, decrypt=True),
+                           chunk_size - chunk_size % BLOCK_BYTES)
+
 def encrypt(binary_plaintext, binary_key):
     """Generate binary ciphertext from binary plaintext with AES."""
-    padded_plaintext = pad_plaintext(binary_plaintext, 128)
-    subkeys = key_schedule(binary_key)
-    final_blocks = []
-    for block in block_split(padded_plaintext, 128):
-        block_matrix = binary_to_matrix(block)
-        block_matrix = add_round_key(block_matrix, subkeys[0])
-        for round in xrange(1, 10):
-            block_matrix = byte_sub(block_matrix)
-            block_matrix = shift_rows(block_matrix)
-            block_matrix = mix_columns(block_matrix, COLUMN_MIX)
-            block_matrix = add_round_key(block_matrix, subkeys[round])
-        block_matrix = byte_sub(block_matrix)
-        block_matrix = shift_rows(block_matrix)
-        block_matrix = add_round_key(block_matrix, subkeys[-1])
-        final_blocks.append(matrix_to_binary(block_matrix))
-    return ''.join(final_blocks)
+    return bytes_to_binary(encrypt_bytes(binary_to_bytes(binary_plaintext),
+                                         binary_to_bytes(binary_key)))
 
 def decrypt(binary_ciphertext, binary_key):
     """Reveal binary plaintext from binary ciphertext with AES."""
-    subkeys = list(reversed(key_schedule(binary_key)))
-    final_blocks = []
-    for block in block_split(binary_ciphertext, 128):
-        block_matrix = binary_to_matrix(block)
-        block_matrix = add_round_key(block_matrix, subkeys[0])
-        block_matrix = inverse_shift_rows(block_matrix)
-        block_matrix = byte_sub(block_matrix, INVERSE_S_BOX)
-        for round in xrange(1, NUMBER_OF_ROUNDS - 1):
-            block_matrix = add_round_key(block_matrix, subkeys[round])
-            block_matrix = mix_columns(block_matrix, INVERSE_COLUMN_MIX)
-            block_matrix = inverse_shift_rows(block_matrix)
-            block_matrix = byte_sub(block_matrix, INVERSE_S_BOX)
-        block_matrix = add_round_key(block_matrix, subkeys[-1])
-        final_blocks.append(matrix_to_binary(block_matrix))
-    return unpad_plaintext(''.join(final_blocks))
+    return bytes_to_binary(decrypt_bytes(binary_to_bytes(binary_ciphertext),
+                                         binary_to_bytes(binary_key)))
 
 def main(args):
+    report = '--report' in args
+    args = [arg for arg in args if arg != '--report']
     if len(args) != 5 or not args[1] in ['--encrypt', '--decrypt']:
         print ('usage: {} <--encrypt|--decrypt> <key> '
-               '<input_file> <output_file>').format(args[0])
+               '<input_file|-> <output_file|-> [--report]').format(args[0])
         return 1
     _, mode, key, input_file, output_file = args
-    binary_input = file_to_binary(input_file)
-    if mode == '--encrypt':
-        output = encrypt(binary_input, format_key(key))
-    else: # mode == '--decrypt'
-        output = decrypt(binary_input, format_key(key))
-    binary_to_file(output, output_file)
+    transform = chunk_transform(binary_to_bytes(format_key(key)),
+                                decrypt=(mode == '--decrypt'))
+    run_pipeline(input_file, output_file, transform, report=report)
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -0,0 +1,139 @@
+#!/usr/local/bin/python
+
+"""
+batch.py
+
+@author Elliot and Erica
+"""
+
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import aes
+import des
+import stream
+from cryptography_utilities import binary_to_bytes, run_pipeline, CHUNK_BYTES
+
+CIPHERS = ['aes', 'des', 'stream']
+
+# Set once per worker process by initialize_worker.
+WORKER_STATE = {}
+
+def block_chunk_size(chunk_size, block_bytes):
+    """Round a chunk size down to a whole number of cipher blocks (at
+    least one), since every chunk but the last must be block aligned.
+    """
+    return max(chunk_size - chunk_size % block_bytes, block_bytes)
+
+def initialize_worker(cipher, key, decrypt, chunk_size,
+                      register=stream.DEFAULT_REGISTER):
+    """Pool initializer. Expand the key schedule once per worker rather
+    than pickling it along with every file.
+    """
+    if cipher == 'aes':
+        chunk_size = block_chunk_size(chunk_size, aes.BLOCK_BYTES)
+        byte_key = binary_to_bytes(aes.format_key(key))
+        aes.aes_key(byte_key)
+        transform_fn = lambda: aes.chunk_transform(byte_key, decrypt)
+    elif cipher == 'des':
+        chunk_size = block_chunk_size(chunk_size, des.BLOCK_BYTES)
+        subkeys = des.integer_subkeys(binary_to_bytes(des.format_key(key)))
+        if decrypt:
+            subkeys.reverse()
+        transform_fn = lambda: des.schedule_transform(subkeys, decrypt)
+    elif cipher == 'stream':
+        # The register is per message, so only the key can be shared.
+        transform_fn = lambda: stream.stream_cipher_chunks(
+            key, stream.xor_combiner, stream.make_register_fn(key, register))
+    else:
+        raise ValueError('Unknown cipher: {}'.format(cipher))
+    WORKER_STATE['transform_fn'] = transform_fn
+    WORKER_STATE['chunk_size'] = chunk_size
+
+def process_file(paths):
+    """Worker task. Run one (input_path, output_path) pair through the
+    worker's cipher and evaluate to (input_path, bytes written, seconds).
+    """
+    input_path, output_path = paths
+    start = time.time()
+    written = run_pipeline(input_path, output_path,
+                           WORKER_STATE['transform_fn'](),
+                           WORKER_STATE['chunk_size'])
+    return input_path, written, time.time() - start
+
+def collect_files(paths, output_directory):
+    """Expand files and directories into (input_path, output_path)
+    pairs. Directory trees are mirrored under output_directory.
+    """
+    pairs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    input_path = os.path.join(root, name)
+                    relative = os.path.relpath(input_path, path)
+                    pairs.append((input_path,
+                                  os.path.join(output_directory, relative)))
+        else:
+            pairs.append((path, os.path.join(output_directory,
+                                             os.path.basename(path))))
+    return pairs
+
+def batch_process(paths, output_directory, cipher, key, decrypt=False,
+                  workers=None, chunk_size=CHUNK_BYTES,
+                  register=stream.DEFAULT_REGISTER):
+    """Encrypt or decrypt many files across a pool of worker processes.
+    register names the stream cipher's register function. Evaluates to
+    a list of (input_path, bytes written, seconds), in input order.
+    """
+    pairs = collect_files(paths, output_directory)
+    for directory in set(os.path.dirname(output_path)
+                         for _, output_path in pairs):
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+    pool = Pool(workers, initialize_worker,
+                (cipher, key, decrypt, chunk_size, register))
+    try:
+        return pool.map(process_file, pairs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def main(args):
+    usage = ('usage: {} <aes|des|stream> <--encrypt|--decrypt> <key> '
+             '<output_directory> <file_or_directory>... '
+             '[--workers N] [--chunk-size BYTES] '
+             '[--register <{}>]').format(
+                 args[0], '|'.join(sorted(stream.REGISTER_FUNCTIONS)))
+    options = {'--workers': None, '--chunk-size': CHUNK_BYTES,
+               '--register': stream.DEFAULT_REGISTER}
+    args = list(args)
+    for option in options:
+        if option in args:
+            place = args.index(option)
+            value = args[place + 1]
+            options[option] = value if option == '--register' else int(value)
+            del args[place:place + 2]
+    if (len(args) < 6 or args[1] not in CIPHERS or
+            args[2] not in ['--encrypt', '--decrypt'] or
+            options['--register'] not in stream.REGISTER_FUNCTIONS):
+        print usage
+        return 1
+    _, cipher, mode, key, output_directory = args[:5]
+    start = time.time()
+    results = batch_process(args[5:], output_directory, cipher, key,
+                            decrypt=(mode == '--decrypt'),
+                            workers=options['--workers'],
+                            chunk_size=options['--chunk-size'],
+                            register=options['--register'])
+    for input_path, written, seconds in results:
+        print '{:>10.3f}s {:>12} bytes  {}'.format(seconds, written, input_path)
+    total = sum(written for _, written, _ in results)
+    elapsed = time.time() - start
+    print '{} files, {} bytes in {:.3f}s ({:.2f} MB/s)'.format(
+        len(results), total, elapsed, total / max(elapsed, 1e-9) / 2**20)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -6,10 +6,20 @@ cryptography_utilities.py
 @author Elliot and Erica
 """
 
+import io
+import os
+import sys
+import mmap
+import time
 import random
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
+from threading import Lock
 
 BYTE_LENGTH = 8
 
+CHUNK_BYTES = 2**20
+
 def decimal_to_binary(decimal):
     """Convert an integer into a binary string. E.g. 5 -> '101'."""
     return format(decimal, 'b')
@@ -36,14 +46,107 @@ def binary_to_string(binary):
 
 def file_to_binary(path):
     """Open a file and dump the contents into a binary string."""
-    with open(path, 'r') as f:
+    with open(path, 'rb') as f:
         return string_to_binary(f.read())
 
 def binary_to_file(text, path):
-    """Write a binary string into a file as ASCII text."""
-    with open(path, 'w') as f:
+    """Write a binary string into a file as raw bytes."""
+    with open(path, 'wb') as f:
         f.write(binary_to_string(text))
 
+def mapped_chunks(path, chunk_size=CHUNK_BYTES):
+    """Memory map a file and yield (chunk, is_last) pairs of at most
+    chunk_size bytes, so only one chunk needs to be resident at a time.
+    An empty file still yields a single empty last chunk.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            yield b'', True
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(mapped)
+        except TypeError:
+            # Python 2's mmap lacks the new buffer interface; slicing the
+            # map itself copies out one chunk at a time instead.
+            view = mapped
+        try:
+            for start in xrange(0, size, chunk_size):
+                yield view[start:start + chunk_size], start + chunk_size >= size
+        finally:
+            del view
+            try:
+                mapped.close()
+            except BufferError:
+                pass # a caller still holds a slice; closed once released
+
+def stream_chunks(stream, chunk_size=CHUNK_BYTES):
+    """Read a binary stream (e.g. stdin) as (chunk, is_last) pairs,
+    looking one chunk ahead to know which is last.
+    """
+    chunk = stream.read(chunk_size)
+    while True:
+        following = stream.read(chunk_size) if chunk else b''
+        yield chunk, not following
+        if not following:
+            return
+        chunk = following
+
+def read_chunks(path, chunk_size=CHUNK_BYTES):
+    """Read stage of a pipeline. A path of '-' reads stdin, anything
+    else is memory mapped.
+    """
+    if path == '-':
+        return stream_chunks(getattr(sys.stdin, 'buffer', sys.stdin),
+                             chunk_size)
+    return mapped_chunks(path, chunk_size)
+
+def transform_chunks(chunks, transform):
+    """Transform stage of a pipeline. Apply transform(chunk, is_last)
+    to each chunk, so padding can be limited to the final one.
+    """
+    for chunk, is_last in chunks:
+        yield transform(chunk, is_last)
+
+def write_chunks(chunks, path):
+    """Write stage of a pipeline. A path of '-' writes to stdout,
+    anything else goes to a buffered file. Evaluates to the number of
+    bytes written.
+    """
+    if path == '-':
+        output = getattr(sys.stdout, 'buffer', sys.stdout)
+        written = sum(output.write(chunk) or len(chunk) for chunk in chunks)
+        output.flush()
+        return written
+    with io.open(path, 'wb') as output:
+        return sum(output.write(chunk) for chunk in chunks)
+
+def run_pipeline(input_path, output_path, transform, chunk_size=CHUNK_BYTES,
+                 report=False):
+    """Stream input_path through transform into output_path, one chunk
+    at a time. With report, print the throughput and peak resident
+    memory to stderr.
+    """
+    start = time.time()
+    chunks = read_chunks(input_path, chunk_size)
+    written = write_chunks(transform_chunks(chunks, transform), output_path)
+    if report:
+        # Unix only, so imported here rather than for every cipher.
+        import resource
+        elapsed = max(time.time() - start, 1e-9)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        sys.stderr.write('{:.2f} MB/s, {} bytes written, peak RSS {} KB\n'
+                         .format(written / elapsed / 2**20, written, peak_rss))
+    return written
+
+def chunked_file_transform(input_path, output_path, transform,
+                           chunk_size=CHUNK_BYTES):
+    """Stream a file through transform(chunk, is_last) into a buffered
+    output file, one mapped_chunks chunk at a time.
+    """
+    run_pipeline(input_path, output_path, transform, chunk_size)
+
 def left_pad(string, size):
     """Add zeros to the front of a string to reach a certain length."""
     return string.zfill(size)
@@ -88,33 +191,135 @@ def bitwise_operation(operation, binaries):
                                   binaries))
                    for index in range(final_length))
 
+def word_operation(operation, binaries):
+    """Apply an integer operation (e.g. word_xor) to a list of binary
+    strings. The binaries are truncated to the shortest length, run
+    through the operation as integers, then converted back.
+    """
+    final_length = min(map(len, binaries))
+    if final_length == 0:
+        return ''
+    words = [binary_to_decimal(binary[:final_length]) for binary in binaries]
+    return left_pad(decimal_to_binary(operation(*words)), final_length)
+
 def bitwise_xor(*binaries):
     """Perform an XOR with the bits of any number of binary strings. The
     output's final length is equal to the shortest binary string.
     """
-    def bit_xor(bit1, bit2):
-        return '1' if int(bit1) != int(bit2) else '0'
-    return bitwise_operation(bit_xor, binaries)
+    return word_operation(word_xor, binaries)
 
 def bitwise_and(*binaries):
     """Perform an AND with the bits of any number of binary strings. The
     output's final length is equal to the shortest binary string.
     """
-    def bit_and(bit1, bit2):
-        return '1' if int(bit1) & int(bit2) else '0'
-    return bitwise_operation(bit_and, binaries)
+    return word_operation(word_and, binaries)
 
 def bitwise_or(*binaries):
     """Perform an OR with the bits of any number of binary strings. The
     output's final length is equal to the shortest binary string.
     """
-    def bit_or(bit1, bit2):
-        return '1' if int(bit1) | int(bit2) else '0'
-    return bitwise_operation(bit_or, binaries)
+    return word_operation(word_or, binaries)
 
 def bitwise_not(binary):
     """Perform a unary NOT operation on the bits of a binary string."""
-    return ''.join('1' if bit == '0' else '0' for bit in binary)
+    if not binary:
+        return ''
+    return left_pad(decimal_to_binary(word_not(binary_to_decimal(binary),
+                                               len(binary))),
+                    len(binary))
+
+def word_mask(bits):
+    """An integer with the lowest number of bits set. E.g. 4 -> 0b1111."""
+    return (1 << bits) - 1
+
+def word_xor(*words):
+    """XOR any number of integers together."""
+    return reduce(lambda x, y: x ^ y, words)
+
+def word_and(*words):
+    """AND any number of integers together."""
+    return reduce(lambda x, y: x & y, words)
+
+def word_or(*words):
+    """OR any number of integers together."""
+    return reduce(lambda x, y: x | y, words)
+
+def word_not(word, bits=32):
+    """Flip every bit of a word that is a certain number of bits wide."""
+    return word ^ word_mask(bits)
+
+def rotate_word_left(word, amount, bits=32):
+    """Move the bits of a word to the left. Bits will be wrapped. E.g.
+    rotate_word_left(0b1011, 1, bits=4) -> 0b0111.
+    """
+    amount %= bits
+    return ((word << amount) | (word >> (bits - amount))) & word_mask(bits)
+
+def rotate_word_right(word, amount, bits=32):
+    """Move the bits of a word to the right. Bits will be wrapped. E.g.
+    rotate_word_right(0b1011, 1, bits=4) -> 0b1101.
+    """
+    return rotate_word_left(word, bits - (amount % bits), bits)
+
+def shift_word_left(word, amount, bits=32):
+    """Shift a word left, dropping bits that leave the word's width."""
+    return (word << amount) & word_mask(bits)
+
+def shift_word_right(word, amount, bits=32):
+    """Shift a word right while maintaining the sign (leftmost) bit,
+    like shift_bits_right.
+    """
+    if word >> (bits - 1):
+        return ((word >> amount) |
+                (word_mask(bits) ^ word_mask(max(bits - amount, 0))))
+    return word >> amount
+
+def bytes_to_int(data):
+    """Interpret a byte string as a big-endian unsigned integer."""
+    return int(hexlify(data), 16) if data else 0
+
+def int_to_bytes(number, length):
+    """Convert an unsigned integer into a big-endian byte string of a
+    certain length.
+    """
+    return unhexlify('%0*x' % (length * 2, number)) if length else b''
+
+def bytes_to_binary(data):
+    """Coerce a byte string into a binary string."""
+    return left_pad(decimal_to_binary(bytes_to_int(data)),
+                    len(data) * BYTE_LENGTH) if data else ''
+
+def binary_to_bytes(binary):
+    """Coerce a binary string (whole bytes) into a byte string."""
+    return int_to_bytes(binary_to_decimal(binary) if binary else 0,
+                        len(binary) // BYTE_LENGTH)
+
+def bytes_operation(operation, datas):
+    """Apply an integer operation to byte strings of equal length. The
+    output's final length is equal to the shortest byte string.
+    """
+    final_length = min(map(len, datas))
+    return int_to_bytes(operation(*[bytes_to_int(data[:final_length])
+                                    for data in datas]),
+                        final_length)
+
+def bytes_xor(*datas):
+    """Perform an XOR with any number of byte strings."""
+    return bytes_operation(word_xor, datas)
+
+def bytes_and(*datas):
+    """Perform an AND with any number of byte strings."""
+    return bytes_operation(word_and, datas)
+
+def bytes_or(*datas):
+    """Perform an OR with any number of byte strings."""
+    return bytes_operation(word_or, datas)
+
+def bytes_not(data):
+    """Perform a unary NOT operation on every bit of a byte string."""
+    return int_to_bytes(word_not(bytes_to_int(data),
+                                 len(data) * BYTE_LENGTH),
+                        len(data))
 
 def pad_plaintext(text, block_size=64):
     """Make the length of the text evenly divisible by the block size by
@@ -132,71 +337,190 @@ def unpad_plaintext(text):
     padding_amount = binary_to_decimal(text[-BYTE_LENGTH:])
     return text[:-(padding_amount * BYTE_LENGTH)]
 
+def pad_bytes(data, block_size=8):
+    """Byte string counterpart to pad_plaintext. The block size is given
+    in bytes; the last byte of the result denotes the number of bytes
+    added.
+    """
+    padding_amount = block_size - (len(data) % block_size)
+    return data + b'\x00' * (padding_amount - 1) + chr(padding_amount)
+
+def unpad_bytes(data):
+    """Byte string counterpart to unpad_plaintext."""
+    return data[:-ord(data[-1:])]
+
 def block_split(text, block_size=64):
     """Divide a string into a list of substrings.
     PRECONDITION: text % block_size == 0"""
     return [text[index:index + block_size]
             for index in xrange(0, len(text), block_size)]
 
+def byte_block_split(data, block_size=8):
+    """Divide a byte string into a list of blocks of block_size bytes.
+    PRECONDITION: len(data) % block_size == 0"""
+    return block_split(data, block_size)
+
 def rotate(list, places):
     """Shift the elements in a list. A positive place will move the list
     to the left, a negative place to the right."""
     return list[places:] + list[:places]
 
-def fermat_test(n):
+SMALL_PRIME_LIMIT = 2**14
+
+MILLER_RABIN_ROUNDS = 20
+
+# Testing these bases is deterministic for every n below the limit
+# (Sorenson and Webster, 2015).
+DETERMINISTIC_BASES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41]
+DETERMINISTIC_LIMIT = 3317044064679887385961981
+
+LEHMER_THRESHOLD = 4096
+
+LEHMER_DIGIT_BITS = 62
+
+def small_primes(limit):
+    """List the primes below limit with the sieve of Eratosthenes."""
+    sieve = bytearray([1]) * limit
+    sieve[:2] = b'\x00\x00'
+    for number in xrange(2, int(limit**0.5) + 1):
+        if sieve[number]:
+            sieve[number * number::number] = \
+                b'\x00' * len(xrange(number * number, limit, number))
+    return [number for number in xrange(limit) if sieve[number]]
+
+SMALL_PRIMES = small_primes(SMALL_PRIME_LIMIT)
+
+SMALL_PRIME_SET = frozenset(SMALL_PRIMES)
+
+def integer_sqrt(n):
+    """Floor of the square root of a non-negative integer, by Newton's
+    method.
+    """
+    if n < 2:
+        return n
+    root = 1 << ((n.bit_length() + 1) // 2)
+    while True:
+        next_root = (root + n // root) // 2
+        if next_root >= root:
+            return root
+        root = next_root
+
+def jacobi_symbol(a, n):
+    """Compute the Jacobi symbol (a/n) for odd positive n."""
+    a, result = a % n, 1
+    while a:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+def fermat_test(n, base=2):
     """Statistically test the primality of a number using the Fermat
     algorithm.
     """
-    return (2**(n - 1) % n) == 1
+    return pow(base, n - 1, n) == 1
+
+def strong_probable_prime(n, base):
+    """Test an odd n > 2 against a single Miller-Rabin base."""
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d, s = d // 2, s + 1
+    x = pow(base, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in xrange(s - 1):
+        x = pow(x, 2, n)
+        if x == n - 1:
+            return True
+    return False
 
-def miller_rabin_test(n):
-    """Statistically test the primality of a number using the Miller-Rabin
-    algorithm.
+def miller_rabin_test(n, rounds=MILLER_RABIN_ROUNDS):
+    """Statistically test the primality of an odd n > 2 using the
+    Miller-Rabin algorithm. Below DETERMINISTIC_LIMIT a fixed set of
+    bases gives an exact answer; above it rounds random bases are
+    tried.
     """
-    k, m = 0, n - 1
-    while True:
-        if m % 2 != 0:
-            break
-        else:
-            k += 1
-            m /= 2
-
-    b = 2**m % n
-
-    if (b - n) == -1 or b == 1:
-        return True
+    if n < DETERMINISTIC_LIMIT:
+        bases = [base for base in DETERMINISTIC_BASES if base < n - 1]
+    else:
+        bases = [random.randrange(2, n - 1) for _ in xrange(rounds)]
+    return all(strong_probable_prime(n, base) for base in bases)
 
-    b = b**2 % n
-    if (b - n) == -1:
+def lucas_test(n):
+    """Strong Lucas probable prime test with Selfridge's parameters,
+    for odd n > 2 that is not a perfect square.
+    """
+    d = 5
+    while jacobi_symbol(d, n) != -1:
+        if jacobi_symbol(d, n) == 0 and abs(d) != n:
+            return False
+        d = -d - 2 if d > 0 else -d + 2
+    p, q = 1, (1 - d) // 4
+    k, s = n + 1, 0
+    while k % 2 == 0:
+        k, s = k // 2, s + 1
+    # Binary ladder for U_k and V_k, with inverse_two standing in for
+    # division by two mod n.
+    inverse_two = (n + 1) // 2
+    u, v, q_power = 1, p, q % n
+    for bit in decimal_to_binary(k)[1:]:
+        u, v = u * v % n, (v * v - 2 * q_power) % n
+        q_power = q_power * q_power % n
+        if bit == '1':
+            u, v = ((p * u + v) * inverse_two % n,
+                    (d * u + p * v) * inverse_two % n)
+            q_power = q_power * q % n
+    if u == 0 or v == 0:
         return True
-
-    for _ in range(2, k):
-        b = b**2 % n
-        if (b - n) == -1:
+    for _ in xrange(s - 1):
+        v = (v * v - 2 * q_power) % n
+        q_power = q_power * q_power % n
+        if v == 0:
             return True
-        if b == 1:
-            return False
     return False
 
-def primep(n):
-    """Combine both the Fermat and Miller-Rabin primality tests into a
-    single function. The predicate should indicate primality with a high
-    likelihood of success.
+def baillie_psw_test(n):
+    """Baillie-PSW test: a strong base 2 test followed by a strong
+    Lucas test. No composite is known to pass both.
+    """
+    if not strong_probable_prime(n, 2):
+        return False
+    if integer_sqrt(n)**2 == n:
+        return False
+    return lucas_test(n)
+
+def primep(n, rounds=MILLER_RABIN_ROUNDS, baillie_psw=False):
+    """Determine primality. Trial division by the cached small primes
+    settles most inputs. Then n below DETERMINISTIC_LIMIT gets an exact
+    Miller-Rabin answer; larger n gets rounds random bases, or a
+    Baillie-PSW test when baillie_psw is set.
     """
-    return fermat_test(n) and miller_rabin_test(n)
+    if n < SMALL_PRIME_LIMIT:
+        return n in SMALL_PRIME_SET
+    for prime in SMALL_PRIMES:
+        if n % prime == 0:
+            return False
+        if prime * prime > n:
+            return True
+    if baillie_psw and n >= DETERMINISTIC_LIMIT:
+        return baillie_psw_test(n)
+    return miller_rabin_test(n, rounds)
 
 def random_number(bits):
     """Generate a random integer that will cleanly fit in a number of bits."""
     max, min = 2**bits - 1, 2**(bits - 1)
     return random.randint(min, max)
 
-def random_prime(bits):
+def random_prime(bits, baillie_psw=False):
     """Generate a random prime that will cleanly fit in a number of bits."""
     while True:
-        n = random_number(bits)
-        if n % 2 == 0 or n % 3 == 0:
-            continue
-        if primep(n):
+        n = random_number(bits) | 1
+        if primep(n, baillie_psw=baillie_psw):
             return n
 
 def coprimep(x, y):
@@ -206,37 +530,135 @@ def gcd(a, b):
     """Greatest common divisor of x and y computed with the Euclidean
     algorithm.
     """
-    return gcd(b, a % b) if b else a
+    while b:
+        a, b = b, a % b
+    return a
+
+def euclid_extended_gcd(a, b):
+    """Iterative extended Euclidean algorithm. Provides a tuple of
+    (g, x, y) from ax + by = gcd(a, b).
+    """
+    x0, y0, x1, y1 = 1, 0, 0, 1
+    while b:
+        q, r = divmod(a, b)
+        a, b = b, r
+        x0, x1 = x1, x0 - q * x1
+        y0, y1 = y1, y0 - q * y1
+    return a, x0, y0
+
+def lehmer_extended_gcd(a, b):
+    """Lehmer's extended GCD (Knuth's Algorithm L) for a >= b >= 0.
+    Runs of quotients are found from the leading LEHMER_DIGIT_BITS of
+    each operand and applied to the full numbers as one 2x2 matrix,
+    replacing many big integer divisions with a few multiplications.
+    """
+    x0, y0, x1, y1 = 1, 0, 0, 1
+    while b.bit_length() > LEHMER_DIGIT_BITS:
+        shift = a.bit_length() - LEHMER_DIGIT_BITS
+        a_high, b_high = a >> shift, b >> shift
+        A, B, C, D = 1, 0, 0, 1
+        while b_high + C and b_high + D:
+            q = (a_high + A) // (b_high + C)
+            if q != (a_high + B) // (b_high + D):
+                break
+            A, B, C, D = C, D, A - q * C, B - q * D
+            a_high, b_high = b_high, a_high - q * b_high
+        if B == 0:
+            q, r = divmod(a, b)
+            a, b = b, r
+            x0, x1 = x1, x0 - q * x1
+            y0, y1 = y1, y0 - q * y1
+        else:
+            a, b = A * a + B * b, C * a + D * b
+            x0, x1 = A * x0 + B * x1, C * x0 + D * x1
+            y0, y1 = A * y0 + B * y1, C * y0 + D * y1
+    g, x, y = euclid_extended_gcd(a, b)
+    return g, x * x0 + y * x1, x * y0 + y * y1
 
 def extended_gcd(a, b):
     """Extended Euclidean algorithm. Provides a tuple of (g, x, y)
-    from ax + by = gcd(a, b). Function taken from Wikibooks.
+    from ax + by = gcd(a, b). Operands of LEHMER_THRESHOLD bits or more
+    go through lehmer_extended_gcd.
     """
-    if a == 0:
-        return (b, 0, 1)
-    else:
-        g, y, x = extended_gcd(b % a, a)
-        return (g, x - (b // a) * y, y)
+    if min(a, b) < 0 or max(a, b).bit_length() < LEHMER_THRESHOLD:
+        return euclid_extended_gcd(a, b)
+    if a < b:
+        g, y, x = lehmer_extended_gcd(b, a)
+        return g, x, y
+    return lehmer_extended_gcd(a, b)
+
+def has_pow_inverse():
+    """Determine if pow accepts a -1 exponent with a modulus (Python
+    3.8 and later).
+    """
+    try:
+        return pow(2, -1, 3) == 2
+    except (ValueError, TypeError):
+        return False
+
+HAS_POW_INVERSE = has_pow_inverse()
 
 def modular_inverse(x, modulus):
-    """Compute x^-1 (mod modulus)."""
-    return extended_gcd(x, modulus)[1]
+    """Compute x^-1 (mod modulus) as a value in [0, modulus)."""
+    if HAS_POW_INVERSE:
+        return pow(x, -1, modulus)
+    g, inverse, _ = extended_gcd(x % modulus, modulus)
+    if g != 1:
+        raise ValueError('{} has no inverse modulo {}'.format(x, modulus))
+    return inverse % modulus
+
+def batch_modular_inverse(values, modulus):
+    """Invert every value (mod modulus) at once with Montgomery's trick:
+    one modular_inverse of the running product and 3(k - 1)
+    multiplications.
+    """
+    if not values:
+        return []
+    products = [values[0] % modulus]
+    for value in values[1:]:
+        products.append(products[-1] * value % modulus)
+    inverse = modular_inverse(products[-1], modulus)
+    inverses = [0] * len(values)
+    for index in xrange(len(values) - 1, 0, -1):
+        inverses[index] = inverse * products[index - 1] % modulus
+        inverse = inverse * values[index] % modulus
+    inverses[0] = inverse
+    return inverses
 
 def modular_sqrt(x, modulus):
-    """Compute sqrt(x) (mod modulus). The modulus must be a prime
-    number.
+    """Compute sqrt(x) (mod modulus) with the Tonelli-Shanks
+    algorithm. The modulus must be an odd prime number.
+    """
+    x %= modulus
+    if x == 0:
+        return 0
+    if pow(x, (modulus - 1) // 2, modulus) != 1:
+        raise AssertionError('No square root')
+    q, s = modulus - 1, 0
+    while q % 2 == 0:
+        q, s = q // 2, s + 1
+    z = 2
+    while pow(z, (modulus - 1) // 2, modulus) != modulus - 1:
+        z += 1
+    c, t = pow(z, q, modulus), pow(x, q, modulus)
+    root = pow(x, (q + 1) // 2, modulus)
+    while t != 1:
+        i, square = 0, t
+        while square != 1:
+            square, i = square * square % modulus, i + 1
+        b = pow(c, 1 << (s - i - 1), modulus)
+        root, c = root * b % modulus, b * b % modulus
+        t, s = t * c % modulus, i
+    return root
+
+def random_relative_prime(prime, bits, generator=random):
+    """Find a number relatively prime (gcd of 1) number randomly. Pass
+    a random.SystemRandom() as generator where the result must be
+    unpredictable.
     """
-    potential_sqrt = pow(x, ((modulus + 1) / 4), modulus)
-    if (potential_sqrt**2 % modulus) == (x % modulus):
-        return int(potential_sqrt)
-    else:
-        raise AssertionError('Composite modulus')
-
-def random_relative_prime(prime, bits):
-    """Find a number relatively prime (gcd of 1) number randomly."""
     max, min = 2**bits - 1, 2**(bits - 1)
     while True:
-        random_int = random.randint(min, max)
+        random_int = generator.randint(min, max)
         if gcd(random_int, prime) == 1:
             return random_int
 
@@ -248,3 +670,37 @@ def group_exponentiation(base, power, n):
         if bit == '1':
             result *= base**(2**bit_index) % n
     return result % n
+
+class LRUCache(object):
+    """A thread safe mapping that keeps only the size most recently used
+    entries. Used to share expanded key schedules between calls.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, build):
+        """Find the value for key, calling build(key) and caching the
+        result (evicting the least recently used entry) on a miss. build
+        runs outside the lock, so slow key expansion does not block
+        other threads.
+        """
+        with self.lock:
+            if key in self.entries:
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                return value
+        value = build(key)
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return value
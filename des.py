@@ -7,11 +7,15 @@ DES.py
 """
 
 import sys
-from cryptography_utilities import (right_pad, left_pad,
-    pad_plaintext, unpad_plaintext, block_split,
+import time
+import struct
+import numpy as np
+from cryptography_utilities import (right_pad, left_pad, block_split,
     decimal_to_binary, binary_to_decimal, string_to_binary,
-    file_to_binary, binary_to_file, shift_bits_left,
-    bitwise_xor)
+    shift_bits_left,
+    bitwise_xor, bytes_to_binary, binary_to_bytes, bytes_to_int,
+    pad_bytes, unpad_bytes, shift_word_left, chunked_file_transform,
+    run_pipeline, CHUNK_BYTES)
 
 S_BOXES = [# S-Box 1
            [[14, 4, 13, 1, 2, 15, 11, 8, 3, 10, 6, 12, 5, 9, 0, 7],
@@ -88,6 +92,69 @@ KEY_LENGTH = 64
 
 BYTE_LENGTH = 8
 
+BLOCK_BYTES = 8
+
+def permute_bits(value, permutation, input_bits):
+    """Integer counterpart to permute. Bit 1 of the permutation is the
+    most significant of input_bits.
+    """
+    output = 0
+    for place in permutation:
+        output = (output << 1) | ((value >> (input_bits - place)) & 1)
+    return output
+
+def byte_permutation_tables(permutation, input_bits=64):
+    """Precompute a permutation one input byte at a time. Table j maps
+    the value of byte j to its output bits, so the whole permutation is
+    the OR of one lookup per input byte.
+    """
+    return [[permute_bits(value << (input_bits - BYTE_LENGTH * (byte + 1)),
+                          permutation, input_bits)
+             for value in xrange(256)]
+            for byte in xrange(input_bits // BYTE_LENGTH)]
+
+def sp_table(s_box, position):
+    """Merge an s-box with C_PERMUTATION. Map every 6-bit input to the
+    s-box's 4-bit output, placed at its position among the eight
+    outputs and then permuted into a 32-bit word.
+    """
+    return [permute_bits(s_box[(six_bits >> 4 & 2) | (six_bits & 1)]
+                              [(six_bits >> 1) & 0xF] << (28 - 4 * position),
+                         C_PERMUTATION, 32)
+            for six_bits in xrange(64)]
+
+SP_TABLES = [sp_table(s_box, position)
+             for position, s_box in enumerate(S_BOXES)]
+
+INITIAL_LEFT_TABLES = byte_permutation_tables(INITIAL_PERMUTATION[:32])
+
+INITIAL_RIGHT_TABLES = byte_permutation_tables(INITIAL_PERMUTATION[32:])
+
+FINAL_LEFT_TABLES = byte_permutation_tables(FINAL_PERMUTATION[:32])
+
+FINAL_RIGHT_TABLES = byte_permutation_tables(FINAL_PERMUTATION[32:])
+
+BITSLICE_LANE_BITS = 64
+
+def s_box_circuit(s_box):
+    """Describe an s-box as a boolean circuit over its six input bits.
+    The inputs are split into a high and a low 3-bit half; each output
+    bit becomes an OR over the eight high-half minterms, each ANDed with
+    the OR of the low-half minterms that set that bit. Evaluates to a
+    list, per output bit (most significant first), of (high, low_mask)
+    pairs.
+    """
+    def output(six_bits):
+        return s_box[(six_bits >> 4 & 2) | (six_bits & 1)][(six_bits >> 1) & 0xF]
+    return [[(high, low_mask)
+             for high in xrange(8)
+             for low_mask in [sum(1 << low for low in xrange(8)
+                                  if output(high << 3 | low) >> bit & 1)]
+             if low_mask]
+            for bit in [3, 2, 1, 0]]
+
+S_BOX_CIRCUITS = [s_box_circuit(s_box) for s_box in S_BOXES]
+
 def set_parity_bit(binary):
     """Use the binary string's rightmost bit as an even parity bit."""
     parity_bit = '0' if binary[:-1].count('1') % 2 == 0 else '1'
@@ -167,30 +234,323 @@ def feistel_scheme(binary_text, subkeys):
         final_blocks.append(block)
     return ''.join(final_blocks)
 
+def integer_subkeys(key):
+    """Integer counterpart to generate_subkeys. Take an 8 byte key and
+    produce sixteen tuples of the eight 6-bit chunks of each round's
+    48-bit subkey.
+    """
+    shuffled_key = permute_bits(bytes_to_int(key), KEY_PERMUTATION_1, 64)
+    ci, di = shuffled_key >> 28, shuffled_key & 0xFFFFFFF
+    subkeys = []
+    for stage_shift in KEY_SHIFTS:
+        ci = shift_word_left(ci, stage_shift, 28)
+        di = shift_word_left(di, stage_shift, 28)
+        subkey = permute_bits(ci << 28 | di, KEY_PERMUTATION_2, 56)
+        subkeys.append(tuple((subkey >> (42 - 6 * place)) & 0x3F
+                             for place in xrange(8)))
+    return subkeys
+
+def integer_feistel_function(half_block, key):
+    """Integer counterpart to feistel_function. The 6-bit expansion
+    chunks are read straight out of the half block rotated right by
+    one (even chunks) and then left by four (odd chunks).
+    """
+    even = ((half_block >> 1) | (half_block << 31)) & 0xFFFFFFFF
+    odd = ((even << 4) | (even >> 28)) & 0xFFFFFFFF
+    sp0, sp1, sp2, sp3, sp4, sp5, sp6, sp7 = SP_TABLES
+    return (sp0[(even >> 26) ^ key[0]] ^
+            sp1[(odd >> 26) ^ key[1]] ^
+            sp2[(even >> 18) & 0x3F ^ key[2]] ^
+            sp3[(odd >> 18) & 0x3F ^ key[3]] ^
+            sp4[(even >> 10) & 0x3F ^ key[4]] ^
+            sp5[(odd >> 10) & 0x3F ^ key[5]] ^
+            sp6[(even >> 2) & 0x3F ^ key[6]] ^
+            sp7[(odd >> 2) & 0x3F ^ key[7]])
+
+def permute_words(high, low, left_tables, right_tables):
+    """Apply a 64-bit permutation, given as byte tables, to a block held
+    as two 32-bit words. Evaluates to the two 32-bit halves of the
+    result.
+    """
+    left = right = 0
+    for byte, value in enumerate([high >> 24, (high >> 16) & 0xFF,
+                                  (high >> 8) & 0xFF, high & 0xFF,
+                                  low >> 24, (low >> 16) & 0xFF,
+                                  (low >> 8) & 0xFF, low & 0xFF]):
+        left |= left_tables[byte][value]
+        right |= right_tables[byte][value]
+    return left, right
+
+def crypt_words(high, low, schedules):
+    """Run a block, held as two 32-bit words, through one DES pass per
+    subkey list in schedules. Chained passes skip the final and initial
+    permutations between them, which cancel out; only the half swap
+    remains.
+    """
+    feistel_function = integer_feistel_function
+    left, right = permute_words(high, low, INITIAL_LEFT_TABLES,
+                                INITIAL_RIGHT_TABLES)
+    for subkeys in schedules:
+        for key in subkeys:
+            right, left = left ^ feistel_function(right, key), right
+        left, right = right, left
+    return permute_words(left, right, FINAL_LEFT_TABLES, FINAL_RIGHT_TABLES)
+
+def integer_feistel_scheme(data, subkeys, schedules=None):
+    """Integer counterpart to feistel_scheme. Run DES over each 8 byte
+    block of data with subkeys from integer_subkeys, or chain several
+    passes by giving a list of subkey lists as schedules.
+    """
+    schedules = schedules or [subkeys]
+    words = struct.unpack('>%dI' % (len(data) // 4), data)
+    output = []
+    for index in xrange(0, len(words), 2):
+        output.extend(crypt_words(words[index], words[index + 1], schedules))
+    return struct.pack('>%dI' % len(output), *output)
+
+def encrypt_bytes(plaintext, key):
+    """Generate ciphertext bytes from plaintext bytes with DES. The key
+    should be 8 bytes (see format_key).
+    """
+    return integer_feistel_scheme(pad_bytes(plaintext, BLOCK_BYTES),
+                                  integer_subkeys(key))
+
+def decrypt_bytes(ciphertext, key):
+    """Reveal plaintext bytes from ciphertext bytes with DES."""
+    return unpad_bytes(integer_feistel_scheme(
+        ciphertext, list(reversed(integer_subkeys(key)))))
+
+def bitslice(blocks):
+    """Transpose an (n, 8) uint8 array of blocks into 64 bit planes.
+    Plane i holds bit i + 1 of every block, packed into uint64 lanes.
+    """
+    lanes = -(-len(blocks) // BITSLICE_LANE_BITS) * BITSLICE_LANE_BITS
+    bits = np.zeros((lanes, KEY_LENGTH), dtype=np.uint8)
+    bits[:len(blocks)] = np.unpackbits(blocks, axis=1)
+    packed = np.ascontiguousarray(np.packbits(bits.T, axis=1))
+    return list(packed.view(np.uint64))
+
+def unbitslice(planes, number_of_blocks):
+    """Transpose 64 bit planes back into an (n, 8) uint8 array."""
+    bits = np.unpackbits(np.array(planes).view(np.uint8), axis=1)
+    return np.packbits(bits.T[:number_of_blocks], axis=1)
+
+def minterms(bits):
+    """All eight ANDs of three bit planes and their complements, indexed
+    by the 3-bit value they match.
+    """
+    lines = [~bits[0], bits[0]]
+    for plane in bits[1:]:
+        inverse = ~plane
+        lines = [line & term for line in lines for term in [inverse, plane]]
+    return lines
+
+def evaluate_s_box(circuit, inputs):
+    """Evaluate an s_box_circuit on six bit planes. Evaluates to four
+    output bit planes.
+    """
+    high_lines = minterms(inputs[:3])
+    low_lines = minterms(inputs[3:])
+    low_unions = {0xFF: None}
+    outputs = []
+    for terms in circuit:
+        output = None
+        for high, low_mask in terms:
+            if low_mask not in low_unions:
+                low_unions[low_mask] = reduce(
+                    np.bitwise_or, [low_lines[low] for low in xrange(8)
+                                    if low_mask >> low & 1])
+            union = low_unions[low_mask]
+            term = high_lines[high] if union is None else high_lines[high] & union
+            output = term if output is None else output | term
+        outputs.append(output)
+    return outputs
+
+def bitsliced_feistel_scheme(blocks, subkeys):
+    """Run DES over every block of an (n, 8) uint8 array at once. The
+    permutations only relabel bit planes, the subkey XOR becomes a NOT
+    of the planes where the key bit is set, and the s-boxes are
+    evaluated as boolean circuits across all lanes.
+    """
+    planes = bitslice(blocks)
+    block = [planes[place - 1] for place in INITIAL_PERMUTATION]
+    left, right = block[:32], block[32:]
+    for key in subkeys:
+        s_box_outputs = []
+        for position, chunk in enumerate(key):
+            inputs = [right[EXPANSION_PERMUTATION[6 * position + bit] - 1]
+                      for bit in xrange(6)]
+            inputs = [~plane if chunk >> (5 - bit) & 1 else plane
+                      for bit, plane in enumerate(inputs)]
+            s_box_outputs.extend(evaluate_s_box(S_BOX_CIRCUITS[position],
+                                                inputs))
+        right, left = [plane ^ s_box_outputs[place - 1]
+                       for plane, place in zip(left, C_PERMUTATION)], right
+    block = right + left
+    return unbitslice([block[place - 1] for place in FINAL_PERMUTATION],
+                      len(blocks))
+
+def encrypt_blocks(blocks, key):
+    """Encrypt an (n, 8) uint8 array of blocks with bitsliced DES (no
+    padding). Best suited to large n, e.g. bulk ECB or counter blocks.
+    """
+    return bitsliced_feistel_scheme(np.asarray(blocks, dtype=np.uint8),
+                                    integer_subkeys(key))
+
+def decrypt_blocks(blocks, key):
+    """Decrypt an (n, 8) uint8 array of blocks with bitsliced DES."""
+    return bitsliced_feistel_scheme(np.asarray(blocks, dtype=np.uint8),
+                                    list(reversed(integer_subkeys(key))))
+
+def benchmark(number_of_blocks=4096, key='benchmark'):
+    """Time ECB encryption of random blocks with the string, table
+    driven and bitsliced implementations. Evaluates to a dictionary of
+    megabytes per second, after checking that all three agree.
+    """
+    data = np.random.randint(0, 256, (number_of_blocks, BLOCK_BYTES)
+                             ).astype(np.uint8).tobytes()
+    binary_key = format_key(key)
+    byte_key = binary_to_bytes(binary_key)
+    subkeys = integer_subkeys(byte_key)
+    megabytes = len(data) / 2.0**20
+
+    def timed(function, *args):
+        start = time.time()
+        output = function(*args)
+        return output, megabytes / (time.time() - start)
+
+    string_output, string_rate = timed(feistel_scheme, bytes_to_binary(data),
+                                       generate_subkeys(binary_key))
+    table_output, table_rate = timed(integer_feistel_scheme, data, subkeys)
+    sliced_output, sliced_rate = timed(
+        bitsliced_feistel_scheme,
+        np.frombuffer(data, dtype=np.uint8).reshape(-1, BLOCK_BYTES), subkeys)
+    if not (binary_to_bytes(string_output) == table_output ==
+            sliced_output.tobytes()):
+        raise AssertionError('DES implementations disagree')
+    return {'string': string_rate, 'table': table_rate,
+            'bitsliced': sliced_rate}
+
+def chunk_transform(key, decrypt=False):
+    """Evaluate to a transform(chunk, is_last) function that encrypts
+    (or decrypts) a message chunk by chunk. Chunks must be a multiple
+    of 8 bytes; only the last one is padded or unpadded.
+    """
+    subkeys = integer_subkeys(key)
+    if decrypt:
+        subkeys.reverse()
+    return schedule_transform(subkeys, decrypt)
+
+def schedule_transform(subkeys, decrypt=False):
+    """chunk_transform for an already computed (and, when decrypting,
+    reversed) list of integer_subkeys.
+    """
+    def transform(chunk, is_last):
+        if is_last and not decrypt:
+            chunk = pad_bytes(memoryview(chunk).tobytes(), BLOCK_BYTES)
+        output = integer_feistel_scheme(chunk, subkeys)
+        return unpad_bytes(output) if is_last and decrypt else output
+    return transform
+
+def encrypt_file(input_path, output_path, key, chunk_size=CHUNK_BYTES):
+    """Encrypt a file with DES chunk by chunk. Only the last chunk is
+    padded, so the output matches encrypt_bytes on the whole file.
+    """
+    chunked_file_transform(input_path, output_path, chunk_transform(key),
+                           chunk_size - chunk_size % BLOCK_BYTES)
+
+def decrypt_file(input_path, output_path, key, chunk_size=CHUNK_BYTES):
+    """Decrypt a DES encrypted file chunk by chunk."""
+    chunked_file_transform(input_path, output_path,
+                           chunk_transform(key, decrypt=True),
+                           chunk_size - chunk_size % BLOCK_BYTES)
+
+class TripleDES(object):
+    """Triple DES (encrypt-decrypt-encrypt) with the three subkey lists
+    computed once. Keys are 24 bytes (three DES keys) or 16 bytes, in
+    which case the first DES key is reused as the third.
+    """
+
+    def __init__(self, key):
+        """Split the key and precompute both EDE schedules."""
+        if len(key) not in [2 * BLOCK_BYTES, 3 * BLOCK_BYTES]:
+            raise ValueError("Triple DES keys must be 16 or 24 bytes.")
+        keys = [key[place:place + BLOCK_BYTES]
+                for place in xrange(0, len(key), BLOCK_BYTES)]
+        if len(keys) == 2:
+            keys.append(keys[0])
+        subkeys = [integer_subkeys(single_key) for single_key in keys]
+        reverse_subkeys = [list(reversed(schedule)) for schedule in subkeys]
+        self.encryption_schedules = [subkeys[0], reverse_subkeys[1],
+                                     subkeys[2]]
+        self.decryption_schedules = [reverse_subkeys[2], subkeys[1],
+                                     reverse_subkeys[0]]
+
+    def encrypt(self, plaintext):
+        """Generate padded ciphertext bytes from plaintext bytes."""
+        return integer_feistel_scheme(pad_bytes(plaintext, BLOCK_BYTES),
+                                      None, self.encryption_schedules)
+
+    def decrypt(self, ciphertext):
+        """Reveal plaintext bytes from ciphertext bytes."""
+        return unpad_bytes(integer_feistel_scheme(
+            ciphertext, None, self.decryption_schedules))
+
+    def encrypt_cbc(self, plaintext, iv):
+        """Encrypt plaintext bytes in cipher block chaining mode. The iv
+        should be 8 bytes.
+        """
+        padded = pad_bytes(plaintext, BLOCK_BYTES)
+        words = struct.unpack('>%dI' % (len(padded) // 4), padded)
+        high, low = struct.unpack('>2I', iv)
+        output = []
+        for index in xrange(0, len(words), 2):
+            high, low = crypt_words(words[index] ^ high,
+                                    words[index + 1] ^ low,
+                                    self.encryption_schedules)
+            output.extend((high, low))
+        return struct.pack('>%dI' % len(output), *output)
+
+    def decrypt_cbc(self, ciphertext, iv):
+        """Reveal plaintext bytes from cipher block chaining ciphertext."""
+        words = struct.unpack('>%dI' % (len(ciphertext) // 4), ciphertext)
+        high, low = struct.unpack('>2I', iv)
+        output = []
+        for index in xrange(0, len(words), 2):
+            plain_high, plain_low = crypt_words(words[index],
+                                                words[index + 1],
+                                                self.decryption_schedules)
+            output.extend((plain_high ^ high, plain_low ^ low))
+            high, low = words[index], words[index + 1]
+        return unpad_bytes(struct.pack('>%dI' % len(output), *output))
+
 def encrypt(binary_plaintext, key):
     """Generate binary ciphertext from binary plaintext with DES."""
-    return feistel_scheme(pad_plaintext(binary_plaintext),
-                          generate_subkeys(key))
+    return bytes_to_binary(encrypt_bytes(binary_to_bytes(binary_plaintext),
+                                         binary_to_bytes(key)))
 
 def decrypt(binary_ciphertext, key):
     """Reveal binary plaintext from binary ciphertext with DES."""
-    plaintext = feistel_scheme(binary_ciphertext,
-                               list(reversed(generate_subkeys(key))))
-    return unpad_plaintext(plaintext)
+    return bytes_to_binary(decrypt_bytes(binary_to_bytes(binary_ciphertext),
+                                         binary_to_bytes(key)))
 
 def main(args):
+    report = '--report' in args
+    args = [arg for arg in args if arg != '--report']
+    if len(args) in [2, 3] and args[1] == '--benchmark':
+        rates = benchmark(*[int(blocks) for blocks in args[2:]])
+        for name in ['string', 'table', 'bitsliced']:
+            print '{:>10}: {:.3f} MB/s'.format(name, rates[name])
+        return 0
     if len(args) != 5 or not args[1] in ['--encrypt', '--decrypt']:
         print ('usage: {} <--encrypt|--decrypt> <key> '
-               '<input_file> <output_file>').format(args[0])
+               '<input_file|-> <output_file|-> [--report]\n'
+               '       {} --benchmark [blocks]').format(args[0], args[0])
         return 1
     _, mode, key, input_file, output_file = args
-    binary_input = file_to_binary(input_file)
-    binary_key = format_key(key)
-    if mode == '--encrypt':
-        output = encrypt(binary_input, binary_key)
-    else: # mode == '--decrypt'
-        output = decrypt(binary_input, binary_key)
-    binary_to_file(output, output_file)
+    transform = chunk_transform(binary_to_bytes(format_key(key)),
+                                decrypt=(mode == '--decrypt'))
+    run_pipeline(input_file, output_file, transform, report=report)
 
 if __name__ == '__main__':
     main(sys.argv)
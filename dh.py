@@ -13,7 +13,7 @@ import random
 from math import sqrt
 
 from cryptography_utilities import (random_number, random_prime, coprimep,
-    extended_gcd, modular_inverse, modular_sqrt)
+    batch_modular_inverse, modular_sqrt)
 
 CURVE25519_PRIME = 2**255 - 19
 
@@ -36,15 +36,15 @@ class DiffieHellman(object):
     def __init__(self, bits=32):
         """Setup with prime modulus and base number public keys and a
         secret random integer smaller than the modulus."""
-        p = random_prime(bits)
+        p = random_prime(bits, baillie_psw=True)
         alpha = random_number(bits) % p
-        if coprimep(p - 1, alpha):
-            self.modulus = p
-            self.base = alpha
-            self.private_key = random.randint(1, p - 2)
-            self.mutual_secret = None # defined in give_key
-        else:
-            type(self)(bits)
+        while not coprimep(p - 1, alpha):
+            p = random_prime(bits, baillie_psw=True)
+            alpha = random_number(bits) % p
+        self.modulus = p
+        self.base = alpha
+        self.private_key = random.randint(1, p - 2)
+        self.mutual_secret = None # defined in give_key
 
     def public_keys(self):
         """Return a tuple of (modulus, base)."""
@@ -95,10 +95,26 @@ def point_add(x1, y1, x2, y2, p):
     """Total two points on an elliptic curve (mod p). We assume that
     x1 == x2 and y1 == y2.
     """
-    if x1 == x2 and y1 == y2:
-        slope = ((3 * x1**2 + CURVE25519_B) * modular_inverse(2 * y1, p)) % p
-    else:
-        slope = ((y2 - y1) * modular_inverse(x2 - x1, p)) % p
-    x3 = (slope**2 - x1 - x2) % p
-    y3 = (slope * (x1 - x3) - y1) % p
-    return (x3, y3)
+    return point_add_many([((x1, y1), (x2, y2))], p)[0]
+
+def point_add_many(pairs, p):
+    """Total many ((x1, y1), (x2, y2)) pairs of points on an elliptic
+    curve (mod p). The slope denominators of every pair are inverted
+    together with a single modular inversion.
+    """
+    numerators, denominators = [], []
+    for (x1, y1), (x2, y2) in pairs:
+        if x1 == x2 and y1 == y2:
+            numerators.append(3 * x1**2 + CURVE25519_B)
+            denominators.append(2 * y1)
+        else:
+            numerators.append(y2 - y1)
+            denominators.append(x2 - x1)
+    sums = []
+    for ((x1, y1), (x2, y2)), numerator, inverse in zip(
+            pairs, numerators, batch_modular_inverse(denominators, p)):
+        slope = (numerator * inverse) % p
+        x3 = (slope**2 - x1 - x2) % p
+        y3 = (slope * (x1 - x3) - y1) % p
+        sums.append((x3, y3))
+    return sums
@@ -12,6 +12,17 @@ ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
 ALPHABET_SIZE = len(ALPHABET)
 N = 3
 TOTIENT_26 = 12
+KEY_BATCH_SIZE = 64
+
+CHAR_MAP = {char: number for number, char in enumerate(ALPHABET)}
+INTEGER_MAP = {number: char for number, char in enumerate(ALPHABET)}
+
+# 256-entry translation tables between byte values and ALPHABET
+# positions. Bytes outside the alphabet map to ALPHABET_SIZE.
+CHAR_TABLE = np.full(256, ALPHABET_SIZE, dtype=np.uint8)
+CHAR_TABLE[[ord(char) for char in ALPHABET]] = np.arange(ALPHABET_SIZE)
+INTEGER_TABLE = ''.join(ALPHABET[number % ALPHABET_SIZE]
+                        for number in range(256))
 
 def random_matrix(size=N):
     """Generate a NxN matrix filled with random integers"""
@@ -20,88 +31,191 @@ def random_matrix(size=N):
              for _ in range(size)]
     return np.matrix(array)
 
-def valid_key(matrix):
+def valid_key(matrix, modulus=ALPHABET_SIZE):
     """Determine if the given matrix can be used as a key"""
-    return gcd(int(np.linalg.det(matrix)), ALPHABET_SIZE) == 1
+    return gcd(modular_determinant(matrix, modulus), modulus) == 1
+
+def prime_factors(number):
+    """List the distinct prime factors of a small integer."""
+    factors, divisor = [], 2
+    while divisor * divisor <= number:
+        if number % divisor == 0:
+            factors.append(divisor)
+            while number % divisor == 0:
+                number //= divisor
+        divisor += 1
+    if number > 1:
+        factors.append(number)
+    return factors
+
+def singular_mod_prime(matrices, prime):
+    """Determine which of a (k, n, n) stack of matrices are singular
+    modulo a prime. Every matrix is row reduced over GF(prime) at the
+    same time.
+    """
+    matrices = np.array(matrices, dtype=np.int64) % prime
+    count, size = matrices.shape[:2]
+    inverses = np.array([0] + [pow(number, prime - 2, prime)
+                               for number in range(1, prime)])
+    singular = np.zeros(count, dtype=bool)
+    everything = np.arange(count)
+    for column in range(size):
+        remaining = matrices[:, column:, column] != 0
+        singular |= ~remaining.any(axis=1)
+        pivots = column + remaining.argmax(axis=1)
+        pivot_rows = matrices[everything, pivots].copy()
+        matrices[everything, pivots] = matrices[:, column]
+        pivot_rows = pivot_rows * inverses[pivot_rows[:, column]][:, None] % prime
+        matrices[:, column] = pivot_rows
+        factors = matrices[:, column + 1:, column:column + 1]
+        matrices[:, column + 1:] = (matrices[:, column + 1:] -
+                                    factors * pivot_rows[:, None]) % prime
+    return singular
 
-def generate_key(size=N):
+def valid_keys(matrices, modulus=ALPHABET_SIZE):
+    """Determine which of a (k, n, n) stack of matrices can be used as
+    keys. A matrix is invertible modulo the alphabet size exactly when
+    it is nonsingular modulo every prime factor of it.
+    """
+    valid = np.ones(len(matrices), dtype=bool)
+    for prime in prime_factors(modulus):
+        valid &= ~singular_mod_prime(matrices, prime)
+    return valid
+
+def generate_key(size=N, modulus=ALPHABET_SIZE):
     """Return a NxN matrix filled with random integers that qualifies
-    as a valid key.
+    as a valid key. Candidates are drawn and checked in batches.
     """
-    matrix = random_matrix()
-    while not valid_matrix(matrix):
-        matrix = random_matrix()
-    return matrix
+    while True:
+        candidates = np.random.randint(0, modulus,
+                                       (KEY_BATCH_SIZE, size, size))
+        valid = np.flatnonzero(valid_keys(candidates, modulus))
+        if len(valid):
+            return np.matrix(candidates[valid[0]])
 
 def to_int(char):
     """Using ALPHABET, find the numeric representation of the given
     character.
     """
-    char_map = {char: number for number, char in enumerate(ALPHABET)}
-    return char_map[char]
+    return CHAR_MAP[char]
 
 def to_char(integer):
     """Using ALPHABET, find the character representation of the given
     integer.
     """
-    integer_map = {number: char for number, char in enumerate(ALPHABET)}
-    return integer_map[integer]
+    return INTEGER_MAP[integer]
 
 def number_matrix(string):
     """Convert a string into an integer matrix."""
-    row = 0
-    array = [[] for _ in range(N)]
-    for char in make_correct_length(string):
-        array[row].append(to_int(char))
-        row = (row + 1) % N
-    return np.matrix(array)
+    return np.matrix(text_blocks(string).T)
+
+def text_blocks(string, size=N):
+    """Convert a string into a (k, size) array with one block of
+    alphabet positions per row, padding with x characters.
+    """
+    numbers = CHAR_TABLE[np.frombuffer(make_correct_length(string, size),
+                                       dtype=np.uint8)]
+    if (numbers == ALPHABET_SIZE).any():
+        raise ValueError('Text contains characters outside ALPHABET.')
+    return numbers.reshape(-1, size)
+
+def blocks_text(blocks):
+    """Convert an array of alphabet positions back into a string."""
+    return np.asarray(blocks, dtype=np.uint8).tobytes().translate(INTEGER_TABLE)
 
-def make_correct_length(string):
+def make_correct_length(string, size=N):
     """Add x characters if the input string cannot be split into even
     blocks.
     """
-    if not len(string) % N == 0:
-        string += 'x' * (N - (len(string) % N))
+    if not len(string) % size == 0:
+        string += 'x' * (size - (len(string) % size))
     return string
 
-def modular_inverse(number):
+def modular_inverse(number, modulus=ALPHABET_SIZE):
     """Calculate the modular multiplicative inverse of a number."""
-    gcd, x, y = extended_gcd(ALPHABET_SIZE, number)
-    if y < 0:
-        return y + 26
-    else:
-        return y
+    gcd, x, y = extended_gcd(modulus, number % modulus)
+    if gcd != 1:
+        raise ValueError('%d has no inverse modulo %d' % (number, modulus))
+    return y % modulus
 
-def switch_key(key):
+def modular_determinant(matrix, modulus=ALPHABET_SIZE):
+    """Calculate the determinant of an integer matrix modulo a number.
+    Uses Bareiss fraction-free elimination, so every intermediate value
+    is an exact integer.
+    """
+    rows = [[int(number) for number in row] for row in np.asarray(matrix)]
+    size, sign, previous = len(rows), 1, 1
+    for column in range(size - 1):
+        if rows[column][column] == 0:
+            for swap in range(column + 1, size):
+                if rows[swap][column] != 0:
+                    rows[column], rows[swap] = rows[swap], rows[column]
+                    sign = -sign
+                    break
+            else:
+                return 0
+        pivot = rows[column][column]
+        for row in range(column + 1, size):
+            for other in range(column + 1, size):
+                rows[row][other] = ((rows[row][other] * pivot -
+                                     rows[row][column] * rows[column][other])
+                                    // previous)
+        previous = pivot
+    return sign * rows[-1][-1] % modulus
+
+def modular_matrix_inverse(matrix, modulus=ALPHABET_SIZE):
+    """Calculate the inverse of an integer matrix modulo any number.
+    Each column is cleared with Euclidean row operations, so pivots do
+    not need to be units until a single entry remains.
+    """
+    matrix = np.asarray(matrix, dtype=np.int64) % modulus
+    size = len(matrix)
+    rows = np.hstack([matrix, np.identity(size, dtype=np.int64)])
+    for column in range(size):
+        while True:
+            entries = rows[column:, column]
+            nonzero = np.flatnonzero(entries)
+            if len(nonzero) == 0:
+                raise ValueError('Matrix is not invertible modulo %d' % modulus)
+            pivot = column + nonzero[entries[nonzero].argmin()]
+            rows[[column, pivot]] = rows[[pivot, column]]
+            quotients = rows[column + 1:, column] // rows[column, column]
+            rows[column + 1:] = (rows[column + 1:] -
+                                 quotients[:, None] * rows[column]) % modulus
+            if not rows[column + 1:, column].any():
+                break
+        rows[column] = (rows[column] *
+                        modular_inverse(rows[column, column], modulus) %
+                        modulus)
+        factors = rows[:, column].copy()
+        factors[column] = 0
+        rows = (rows - factors[:, None] * rows[column]) % modulus
+    return rows[:, size:]
+
+def switch_key(key, modulus=ALPHABET_SIZE):
     """Change an encryption key into a decryption key or
     vice-versa.
     """
-    key_determinant = int(np.linalg.det(key))
-    inverse = np.linalg.inv(key)
-    adjugate = np.multiply(inverse, key_determinant)
-    raw_switch = np.multiply(modular_inverse(key_determinant),
-                             adjugate)
-    modder = np.vectorize(lambda n: int(n) % 26)
-    return modder(raw_switch)
+    return np.matrix(modular_matrix_inverse(key, modulus))
+
+def hill_cipher_transform(text, key):
+    """Multiply every block of text by the key at once, mod the
+    alphabet size.
+    """
+    key = np.asarray(key, dtype=np.int64)
+    blocks = text_blocks(text, len(key)).astype(np.int64)
+    return blocks_text(blocks.dot(key.T) % ALPHABET_SIZE)
 
 def hill_cipher_encrypt(plain_text, key):
     """Determine cipher text given plain text. The key should be an
     NxN matrix.
     """
-    cipher_matrix = np.dot(key, number_matrix(plain_text))
-    cipher_text = ''
-    for number in np.nditer(cipher_matrix):
-        cipher_text += to_char(number % ALPHABET_SIZE)
-    return cipher_text
-    
+    return hill_cipher_transform(plain_text, key)
+
 def hill_cipher_decrypt(cipher_text, key, encryption_key=False):
     """Determine plain text given cipher text. The key should be an
     NxN matrix.
     """
     if encryption_key:
         key = switch_key(key)
-    plain_matrix = np.dot(key, number_matrix(cipher_text))
-    plain_text = ''
-    for number in np.nditer(plain_matrix):
-        plain_text += to_char(number % ALPHABET_SIZE)
-    return plain_text
+    return hill_cipher_transform(cipher_text, key)
@@ -0,0 +1,181 @@
+#!/usr/local/bin/python
+
+"""
+hill_cryptanalysis.py
+
+@author Elliot and Erica
+"""
+
+import sys
+import itertools
+from multiprocessing import Pool
+import numpy as np
+from hill_cipher import (ALPHABET, ALPHABET_SIZE, N, KEY_BATCH_SIZE,
+                         text_blocks, valid_keys,
+                         modular_matrix_inverse, switch_key,
+                         hill_cipher_decrypt)
+
+# Relative frequency of each letter of ALPHABET in English text.
+ENGLISH_FREQUENCIES = np.array([
+    0.08167, 0.01492, 0.02782, 0.04253, 0.12702, 0.02228, 0.02015,
+    0.06094, 0.06966, 0.00153, 0.00772, 0.04025, 0.02406, 0.06749,
+    0.07507, 0.01929, 0.00095, 0.05987, 0.06327, 0.09056, 0.02758,
+    0.00978, 0.02360, 0.00150, 0.01974, 0.00074])
+
+COMMON_BIGRAMS = ('th he in er an re on at en nd ti es or te of ed is it '
+                  'al ar st to nt ng se ha as ou io le ve co me de hi ri '
+                  'ro ic ne ea ra ce').split()
+
+# Flat lookup table over first * ALPHABET_SIZE + second.
+BIGRAM_TABLE = np.zeros(ALPHABET_SIZE**2, dtype=bool)
+BIGRAM_TABLE[[ALPHABET.index(first) * ALPHABET_SIZE + ALPHABET.index(second)
+              for first, second in COMMON_BIGRAMS]] = True
+
+ROW_BATCH_SIZE = 4096
+SEARCH_CHUNK_SIZE = 2**16
+TOP_ROWS = 8
+
+# Set once per worker process by initialize_worker.
+WORKER_STATE = {}
+
+def recover_key(plain_text, cipher_text, size=N):
+    """Known plaintext attack. Solve C = P * K^T for the encryption
+    key K using size plaintext blocks that are invertible modulo the
+    alphabet size. Every other block pair is then checked against the
+    recovered key.
+    """
+    plain_blocks = text_blocks(plain_text, size)
+    cipher_blocks = text_blocks(cipher_text, size)
+    count = min(len(plain_blocks), len(cipher_blocks))
+    plain_blocks, cipher_blocks = plain_blocks[:count], cipher_blocks[:count]
+    selections = itertools.combinations(range(count), size)
+    while True:
+        batch = list(itertools.islice(selections, KEY_BATCH_SIZE))
+        if not batch:
+            raise ValueError('Not enough independent plaintext blocks.')
+        valid = np.flatnonzero(valid_keys(plain_blocks[np.array(batch)]))
+        if len(valid):
+            break
+    chosen = list(batch[valid[0]])
+    inverse = modular_matrix_inverse(plain_blocks[chosen])
+    key = inverse.dot(cipher_blocks[chosen].astype(np.int64)).T % ALPHABET_SIZE
+    if (plain_blocks.astype(np.int64).dot(key.T) % ALPHABET_SIZE !=
+            cipher_blocks).any():
+        raise ValueError('Plaintext and ciphertext do not share a key.')
+    return np.matrix(key)
+
+def candidate_rows(start, stop, size=N):
+    """Enumerate key rows start through stop - 1, reading each index
+    as size base ALPHABET_SIZE digits.
+    """
+    indexes = np.arange(start, stop, dtype=np.int64)
+    places = ALPHABET_SIZE ** np.arange(size, dtype=np.int64)
+    return indexes[:, None] // places % ALPHABET_SIZE
+
+def letter_counts(letters):
+    """Count each letter in every row of a (k, length) array."""
+    rows = len(letters)
+    offsets = letters + ALPHABET_SIZE * np.arange(rows)[:, None]
+    return np.bincount(offsets.ravel(),
+                       minlength=rows * ALPHABET_SIZE).reshape(rows, -1)
+
+def frequency_scores(letters):
+    """Chi-squared distance between the letter distribution of each
+    row and English. Lower is more English-like.
+    """
+    expected = ENGLISH_FREQUENCIES * letters.shape[1]
+    return (((letter_counts(letters) - expected) ** 2) / expected).sum(axis=1)
+
+def score_rows(cipher_blocks, start, stop):
+    """Score decryption key rows start through stop - 1 against the
+    ciphertext, ROW_BATCH_SIZE rows per NumPy operation. Evaluates to
+    the TOP_ROWS best as a list of (score, row index).
+    """
+    cipher_blocks = cipher_blocks.astype(np.int64)
+    size = cipher_blocks.shape[1]
+    best = []
+    for batch_start in range(start, stop, ROW_BATCH_SIZE):
+        batch_stop = min(batch_start + ROW_BATCH_SIZE, stop)
+        rows = candidate_rows(batch_start, batch_stop, size)
+        scores = frequency_scores(rows.dot(cipher_blocks.T) % ALPHABET_SIZE)
+        top = np.argsort(scores)[:TOP_ROWS]
+        best.extend(zip(scores[top].tolist(), (top + batch_start).tolist()))
+        best = sorted(best)[:TOP_ROWS]
+    return best
+
+def initialize_worker(cipher_blocks):
+    """Pool initializer. Ship the ciphertext to each worker once."""
+    WORKER_STATE['cipher_blocks'] = cipher_blocks
+
+def score_chunk(bounds):
+    """Worker task. score_rows over one chunk of the key row space."""
+    return score_rows(WORKER_STATE['cipher_blocks'], *bounds)
+
+def search_rows(cipher_blocks, workers=None, chunk_size=SEARCH_CHUNK_SIZE):
+    """Score every possible decryption key row and evaluate to the
+    TOP_ROWS best as rows. Chunks of the row space are spread across a
+    pool of worker processes when there is more than one.
+    """
+    size = cipher_blocks.shape[1]
+    total = ALPHABET_SIZE ** size
+    chunks = [(start, min(start + chunk_size, total))
+              for start in range(0, total, chunk_size)]
+    if len(chunks) == 1 or workers == 1:
+        results = [score_rows(cipher_blocks, *bounds) for bounds in chunks]
+    else:
+        pool = Pool(workers, initialize_worker, (cipher_blocks,))
+        try:
+            results = pool.map(score_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    best = sorted(itertools.chain(*results))[:TOP_ROWS]
+    return np.vstack([candidate_rows(index, index + 1, size)
+                      for _, index in best])
+
+def bigram_scores(letters):
+    """Count common English bigrams in every row of a (k, length)
+    array of alphabet positions.
+    """
+    pairs = letters[:, :-1] * ALPHABET_SIZE + letters[:, 1:]
+    return BIGRAM_TABLE[pairs].sum(axis=1)
+
+def break_cipher(cipher_text, size=N, workers=None):
+    """Ciphertext only attack. Each row of the decryption key yields
+    every size-th plaintext letter, so rows are scored independently by
+    letter frequency. The best rows are then arranged into invertible
+    decryption keys and ordered by common bigrams. Evaluates to
+    (encryption key, plain text).
+    """
+    cipher_blocks = text_blocks(cipher_text, size)
+    rows = search_rows(cipher_blocks, workers)
+    arrangements = np.array(list(itertools.permutations(range(len(rows)),
+                                                        size)))
+    keys = rows[arrangements]
+    keys = keys[valid_keys(keys)]
+    if not len(keys):
+        raise ValueError('No invertible key among the best rows.')
+    plain_blocks = np.einsum('kij,bj->kbi', keys,
+                             cipher_blocks.astype(np.int64)) % ALPHABET_SIZE
+    letters = plain_blocks.reshape(len(keys), -1)
+    decryption_key = np.matrix(keys[bigram_scores(letters).argmax()])
+    return (switch_key(decryption_key),
+            hill_cipher_decrypt(cipher_text, decryption_key))
+
+def main(args):
+    usage = ('usage: {} <--known <plain_text> | --break> <cipher_text> '
+             '[size]').format(args[0])
+    if len(args) < 3 or args[1] not in ['--known', '--break']:
+        print usage
+        return 1
+    if args[1] == '--known':
+        size = int(args[4]) if len(args) > 4 else N
+        print recover_key(args[2], args[3], size)
+    else:
+        size = int(args[3]) if len(args) > 3 else N
+        key, plain_text = break_cipher(args[2], size)
+        print key
+        print plain_text
+
+if __name__ == '__main__':
+    main(sys.argv)
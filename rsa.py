@@ -6,35 +6,202 @@ RSA.py
 @author Elliot and Erica
 """
 
+import time
 import random
+from multiprocessing import Pool
 
 from cryptography_utilities import (block_split, decimal_to_binary,
-    binary_to_decimal, extended_gcd, random_prime, left_pad,
-    pad_plaintext, unpad_plaintext, random_relative_prime)
+    binary_to_decimal, modular_inverse, coprimep, left_pad, pad_plaintext,
+    unpad_plaintext, random_relative_prime, miller_rabin_test, BYTE_LENGTH,
+    SMALL_PRIMES, SMALL_PRIME_LIMIT)
 
 MODULUS_BITS = 16
 
-def key_generation():
-    """Return a tuple of (modulus, public_key, private_key). The size of
-    modulus (and associated primes) is determined by the MODULUS_BITS
-    global.
+PUBLIC_EXPONENT = 65537
+
+SIEVE_WINDOW = 2**12
+
+# Two distinct primes with their top two bits set need at least 5 bits.
+MIN_MODULUS_BITS = 10
+
+# Key material comes from the operating system, not Mersenne Twister.
+SYSTEM_RANDOM = random.SystemRandom()
+
+# pad_plaintext records the padding length in a single byte.
+MAX_PLAINTEXT_BLOCK_BITS = 255 * BYTE_LENGTH
+
+def sieve_window(primes, residues, window):
+    """Mark window odd candidates start, start + 2, ... that have a
+    factor among primes. residues holds start % prime for each of the
+    (odd) primes.
+    """
+    composite = bytearray(window)
+    for prime, residue in zip(primes, residues):
+        # Solve start + 2i = 0 (mod prime) for the first offset i.
+        first = (prime - residue) * ((prime + 1) // 2) % prime
+        composite[first::prime] = b'\x01' * len(xrange(first, window, prime))
+    return composite
+
+def search_prime(bits, public_exponent=PUBLIC_EXPONENT):
+    """Find a random prime of exactly bits bits with its top two bits
+    set, so the product of two such primes has exactly 2 * bits bits.
+    Candidates are sieved a window at a time, updating the residues in
+    place between windows, and only survivors are Miller-Rabin tested.
+    Evaluates to (prime, candidates, tests).
+    """
+    sieve_primes = [prime for prime in SMALL_PRIMES[1:] if prime < 2**bits]
+    candidates = tests = 0
+    while True:
+        start = SYSTEM_RANDOM.getrandbits(bits) | (3 << (bits - 2)) | 1
+        residues = [start % prime for prime in sieve_primes]
+        while start < 2**bits:
+            composite = sieve_window(sieve_primes, residues, SIEVE_WINDOW)
+            for offset in xrange(SIEVE_WINDOW):
+                candidate = start + 2 * offset
+                if candidate >= 2**bits:
+                    break
+                candidates += 1
+                if composite[offset] and candidate >= SMALL_PRIME_LIMIT:
+                    continue
+                if candidate % public_exponent == 1:
+                    continue
+                tests += 1
+                if miller_rabin_test(candidate):
+                    return candidate, candidates, tests
+            start += 2 * SIEVE_WINDOW
+            residues = [(residue + 2 * SIEVE_WINDOW) % prime
+                        for prime, residue in zip(sieve_primes, residues)]
+
+def search_prime_task(arguments):
+    """Pool task. Starting points come from SYSTEM_RANDOM, so forked
+    workers do not all walk the same candidates.
+    """
+    return search_prime(*arguments)
+
+def generate_primes(bits, count=2, workers=None):
+    """Find count distinct primes of bits bits. With workers, searches
+    from independent starting points run across a process pool and the
+    first count results win.
+    """
+    if workers is None:
+        results = []
+        while len(set(prime for prime, _, _ in results)) < count:
+            results.append(search_prime(bits))
+        return results
+    pool = Pool(workers)
+    try:
+        results = []
+        searches = pool.imap_unordered(search_prime_task,
+                                       [(bits,)] * (count + 2 * workers))
+        for result in searches:
+            if result[0] not in [prime for prime, _, _ in results]:
+                results.append(result)
+            if len(results) == count:
+                return results
+        raise ValueError('Could not find enough distinct primes.')
+    finally:
+        pool.terminate()
+        pool.join()
+
+class RSAPrivateKey(object):
+    """An RSA private key that keeps its primes. Private operations
+    are split into two half size exponentiations with the Chinese
+    Remainder Theorem, and every result is checked with the public
+    exponent so a faulty computation never leaks.
     """
-    prime1 = random_prime(MODULUS_BITS / 2)
-    prime2 = random_prime(MODULUS_BITS / 2)
-    modulus = prime1 * prime2
+
+    def __init__(self, prime1, prime2, public_key, private_key):
+        """Precompute dP, dQ and qInv from the primes and exponents."""
+        self.prime1, self.prime2 = prime1, prime2
+        self.modulus = prime1 * prime2
+        self.public_key = public_key
+        self.private_key = private_key
+        self.exponent1 = private_key % (prime1 - 1)
+        self.exponent2 = private_key % (prime2 - 1)
+        self.coefficient = modular_inverse(prime2, prime1)
+
+    def public_keys(self):
+        """Return a tuple of (modulus, public_key)."""
+        return self.modulus, self.public_key
+
+    def private_exponentiation(self, integer):
+        """Compute integer^private_key (mod modulus) with the CRT."""
+        result1 = pow(integer % self.prime1, self.exponent1, self.prime1)
+        result2 = pow(integer % self.prime2, self.exponent2, self.prime2)
+        difference = self.coefficient * (result1 - result2) % self.prime1
+        result = result2 + difference * self.prime2
+        if pow(result, self.public_key, self.modulus) != integer % self.modulus:
+            raise ValueError('RSA private operation failed its public '
+                             'key check.')
+        return result
+
+    def decrypt(self, binary_ciphertext):
+        """Reveal binary plaintext from binary ciphertext with RSA."""
+        bits = modulus_bits(self.modulus)
+        plaintext = ''.join(
+            left_pad(decimal_to_binary(self.private_exponentiation(
+                binary_to_decimal(block))), plaintext_block_size(bits))
+            for block in block_split(binary_ciphertext, bits))
+        return unpad_plaintext(plaintext)
+
+    def sign(self, binary_message):
+        """Produce a binary signature for a message (or message digest)
+        smaller than the modulus.
+        """
+        message = binary_to_decimal(binary_message)
+        if message >= self.modulus:
+            raise ValueError('Message must be smaller than the modulus.')
+        return left_pad(decimal_to_binary(self.private_exponentiation(message)),
+                        modulus_bits(self.modulus))
+
+def verify(binary_message, binary_signature, modulus, public_key):
+    """Check an RSA signature against a binary message."""
+    return (pow(binary_to_decimal(binary_signature), public_key, modulus) ==
+            binary_to_decimal(binary_message))
+
+def generate_private_key(bits=MODULUS_BITS, workers=None):
+    """Generate an RSAPrivateKey with a modulus of exactly bits bits,
+    which must be even and at least MIN_MODULUS_BITS. Prime searches
+    run in a process pool when workers is given. Search statistics are
+    kept on the key's generation_stats.
+    """
+    if bits % 2 or bits < MIN_MODULUS_BITS:
+        raise ValueError('RSA modulus bits must be even and at least '
+                         '{}.'.format(MIN_MODULUS_BITS))
+    start = time.time()
+    results = generate_primes(bits // 2, 2, workers)
+    (prime1, _, _), (prime2, _, _) = results[-2:]
     totient = (prime1 - 1) * (prime2 - 1)
-    public_key = random_relative_prime(totient, MODULUS_BITS / 2)
-    if extended_gcd(public_key, totient)[1] < 0:
-        private_key = extended_gcd(public_key, totient)[1] + totient
+    if PUBLIC_EXPONENT < totient and coprimep(PUBLIC_EXPONENT, totient):
+        public_key = PUBLIC_EXPONENT
     else:
-        private_key = extended_gcd(public_key, totient)[1]
-    return modulus, public_key, private_key
+        public_key = random_relative_prime(totient, bits // 2, SYSTEM_RANDOM)
+    private_key = modular_inverse(public_key, totient)
+    key = RSAPrivateKey(prime1, prime2, public_key, private_key)
+    key.generation_stats = {
+        'seconds': time.time() - start,
+        'candidates': sum(candidates for _, candidates, _ in results),
+        'miller_rabin_tests': sum(tests for _, _, tests in results)}
+    return key
+
+def key_generation(bits=MODULUS_BITS, workers=None):
+    """Return a tuple of (modulus, public_key, private_key). The modulus
+    will be exactly bits bits, MODULUS_BITS by default.
+    """
+    key = generate_private_key(bits, workers)
+    return key.modulus, key.public_key, key.private_key
+
+def modulus_bits(modulus):
+    """Number of bits in a modulus, which is the ciphertext block
+    size.
+    """
+    return len(decimal_to_binary(modulus))
 
-def plaintext_block_size():
-    """Determine a block size using the MODULUS_BITS global. The value
-    will be a multiple of eight and less than MODULUS_BITS.
+def plaintext_block_size(bits=MODULUS_BITS):
+    """Determine a block size for a modulus of bits bits. The value
+    will be a multiple of eight and less than bits.
     """
-    return (MODULUS_BITS - 1) - ((MODULUS_BITS - 1) % 8)
+    return min((bits - 1) - ((bits - 1) % 8), MAX_PLAINTEXT_BLOCK_BITS)
 
 def rsa_exponentiation(text, modulus, key):
     """Perform modular exponentiation of a message based on a key. I.E.
@@ -45,15 +212,17 @@ def rsa_exponentiation(text, modulus, key):
 
 def encrypt(binary_plaintext, modulus, public_key):
     """Generate binary ciphertext from binary plaintext with RSA."""
-    padded_plaintext = pad_plaintext(binary_plaintext, plaintext_block_size())
+    bits = modulus_bits(modulus)
+    block_size = plaintext_block_size(bits)
+    padded_plaintext = pad_plaintext(binary_plaintext, block_size)
     return ''.join(left_pad(rsa_exponentiation(block, modulus, public_key),
-                            MODULUS_BITS)
-                   for block in block_split(padded_plaintext,
-                                            plaintext_block_size()))
+                            bits)
+                   for block in block_split(padded_plaintext, block_size))
 
 def decrypt(binary_ciphertext, modulus, private_key):
     """Reveal binary plaintext from binary ciphertext with RSA."""
+    bits = modulus_bits(modulus)
     plaintext = ''.join(left_pad(rsa_exponentiation(block, modulus, private_key),
-                                 plaintext_block_size())
-                        for block in block_split(binary_ciphertext, MODULUS_BITS))
+                                 plaintext_block_size(bits))
+                        for block in block_split(binary_ciphertext, bits))
     return unpad_plaintext(plaintext)
@@ -6,9 +6,13 @@ sha_1.py
 @author Elliot and Erica
 """
 
+import struct
+from binascii import hexlify
+import numpy as np
 from cryptography_utilities import (wrap_bits_left, decimal_to_binary,
     binary_to_decimal, pad_plaintext, block_split, bitwise_and,
-    bitwise_or, bitwise_xor, bitwise_not, hex_to_binary)
+    bitwise_or, bitwise_xor, bitwise_not, hex_to_binary, left_pad,
+    binary_to_bytes, bytes_xor, mapped_chunks, CHUNK_BYTES, LRUCache)
 
 BLOCKSIZE = 512
 
@@ -16,6 +20,15 @@ SUB_BLOCKSIZE = 32
 
 SHA_1_INTERVALS = 80
 
+BLOCK_BYTES = BLOCKSIZE // 8
+
+INITIAL_REGISTERS = (0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0)
+
+HMAC_KEY_CACHE_SIZE = 64
+
+ROUND_CONSTANTS = [0x5A827999] * 20 + [0x6ED9EBA1] * 20 + \
+                  [0x8F1BBCDC] * 20 + [0xCA62C1D6] * 20
+
 def add(*binaries):
     """Execute modular arithmetic mod 2^32. Input may consist of any
     number of binary strings.
@@ -23,7 +36,7 @@ def add(*binaries):
     total = 0
     for binary in binaries:
         total += binary_to_decimal(binary) % 2**32
-    return decimal_to_binary(total % 2**32)
+    return left_pad(decimal_to_binary(total % 2**32), SUB_BLOCKSIZE)
 
 def mixing_operation(interval, b, c, d):
     """Perform one of four operations, based on the interval. The b, c, and
@@ -92,11 +105,282 @@ def sha_1(binary_message):
     """SHA-1 cryptographic hash function. Take a binary string of any
     length and output an obfuscated 160-bit binary hash."""
     padded_message = pad_plaintext(binary_message, BLOCKSIZE)
-    sub_registers = [hex_to_binary(initial_register)
-                     for initial_register
-                     in ['67452301', 'EFCDAB89', '98BADCFE',
-                         '10325476', 'C3D2E1F0']]
+    sub_registers = INITIAL_REGISTERS
     for block in block_split(padded_message, BLOCKSIZE):
-        sub_blocks = sha_1_expansion(block)
-        sub_registers = sha_1_compression(sub_registers, sub_blocks)
-    return ''.join(sub_registers)
+        sub_registers = compress_block(sub_registers, binary_to_bytes(block))
+    return ''.join(left_pad(decimal_to_binary(register), SUB_BLOCKSIZE)
+                   for register in sub_registers)
+
+def compress_block(sub_registers, block):
+    """Integer counterpart to sha_1_expansion and sha_1_compression.
+    Fold one 64 byte block into a tuple of five 32-bit sub-registers.
+    The message schedule is filled into a preallocated list and each
+    20 interval phase runs its own loop, five intervals per pass so the
+    registers rotate by renaming instead of shuffling.
+    """
+    w = list(struct.unpack('>16I', block)) + [0] * (SHA_1_INTERVALS - 16)
+    for interval in xrange(16, SHA_1_INTERVALS):
+        word = w[interval - 3] ^ w[interval - 8] ^ w[interval - 14] ^ w[interval - 16]
+        w[interval] = ((word << 1) | (word >> 31)) & 0xFFFFFFFF
+    a, b, c, d, e = sub_registers
+
+    for interval in xrange(0, 20, 5):
+        e = (e + (((a << 5) | (a >> 27)) & 0xFFFFFFFF) + (d ^ (b & (c ^ d))) +
+             0x5A827999 + w[interval]) & 0xFFFFFFFF
+        b = ((b << 30) | (b >> 2)) & 0xFFFFFFFF
+        d = (d + (((e << 5) | (e >> 27)) & 0xFFFFFFFF) + (c ^ (a & (b ^ c))) +
+             0x5A827999 + w[interval + 1]) & 0xFFFFFFFF
+        a = ((a << 30) | (a >> 2)) & 0xFFFFFFFF
+        c = (c + (((d << 5) | (d >> 27)) & 0xFFFFFFFF) + (b ^ (e & (a ^ b))) +
+             0x5A827999 + w[interval + 2]) & 0xFFFFFFFF
+        e = ((e << 30) | (e >> 2)) & 0xFFFFFFFF
+        b = (b + (((c << 5) | (c >> 27)) & 0xFFFFFFFF) + (a ^ (d & (e ^ a))) +
+             0x5A827999 + w[interval + 3]) & 0xFFFFFFFF
+        d = ((d << 30) | (d >> 2)) & 0xFFFFFFFF
+        a = (a + (((b << 5) | (b >> 27)) & 0xFFFFFFFF) + (e ^ (c & (d ^ e))) +
+             0x5A827999 + w[interval + 4]) & 0xFFFFFFFF
+        c = ((c << 30) | (c >> 2)) & 0xFFFFFFFF
+
+    for interval in xrange(20, 40, 5):
+        e = (e + (((a << 5) | (a >> 27)) & 0xFFFFFFFF) + (b ^ c ^ d) +
+             0x6ED9EBA1 + w[interval]) & 0xFFFFFFFF
+        b = ((b << 30) | (b >> 2)) & 0xFFFFFFFF
+        d = (d + (((e << 5) | (e >> 27)) & 0xFFFFFFFF) + (a ^ b ^ c) +
+             0x6ED9EBA1 + w[interval + 1]) & 0xFFFFFFFF
+        a = ((a << 30) | (a >> 2)) & 0xFFFFFFFF
+        c = (c + (((d << 5) | (d >> 27)) & 0xFFFFFFFF) + (e ^ a ^ b) +
+             0x6ED9EBA1 + w[interval + 2]) & 0xFFFFFFFF
+        e = ((e << 30) | (e >> 2)) & 0xFFFFFFFF
+        b = (b + (((c << 5) | (c >> 27)) & 0xFFFFFFFF) + (d ^ e ^ a) +
+             0x6ED9EBA1 + w[interval + 3]) & 0xFFFFFFFF
+        d = ((d << 30) | (d >> 2)) & 0xFFFFFFFF
+        a = (a + (((b << 5) | (b >> 27)) & 0xFFFFFFFF) + (c ^ d ^ e) +
+             0x6ED9EBA1 + w[interval + 4]) & 0xFFFFFFFF
+        c = ((c << 30) | (c >> 2)) & 0xFFFFFFFF
+
+    for interval in xrange(40, 60, 5):
+        e = (e + (((a << 5) | (a >> 27)) & 0xFFFFFFFF) + ((b & c) | (d & (b | c))) +
+             0x8F1BBCDC + w[interval]) & 0xFFFFFFFF
+        b = ((b << 30) | (b >> 2)) & 0xFFFFFFFF
+        d = (d + (((e << 5) | (e >> 27)) & 0xFFFFFFFF) + ((a & b) | (c & (a | b))) +
+             0x8F1BBCDC + w[interval + 1]) & 0xFFFFFFFF
+        a = ((a << 30) | (a >> 2)) & 0xFFFFFFFF
+        c = (c + (((d << 5) | (d >> 27)) & 0xFFFFFFFF) + ((e & a) | (b & (e | a))) +
+             0x8F1BBCDC + w[interval + 2]) & 0xFFFFFFFF
+        e = ((e << 30) | (e >> 2)) & 0xFFFFFFFF
+        b = (b + (((c << 5) | (c >> 27)) & 0xFFFFFFFF) + ((d & e) | (a & (d | e))) +
+             0x8F1BBCDC + w[interval + 3]) & 0xFFFFFFFF
+        d = ((d << 30) | (d >> 2)) & 0xFFFFFFFF
+        a = (a + (((b << 5) | (b >> 27)) & 0xFFFFFFFF) + ((c & d) | (e & (c | d))) +
+             0x8F1BBCDC + w[interval + 4]) & 0xFFFFFFFF
+        c = ((c << 30) | (c >> 2)) & 0xFFFFFFFF
+
+    for interval in xrange(60, 80, 5):
+        e = (e + (((a << 5) | (a >> 27)) & 0xFFFFFFFF) + (b ^ c ^ d) +
+             0xCA62C1D6 + w[interval]) & 0xFFFFFFFF
+        b = ((b << 30) | (b >> 2)) & 0xFFFFFFFF
+        d = (d + (((e << 5) | (e >> 27)) & 0xFFFFFFFF) + (a ^ b ^ c) +
+             0xCA62C1D6 + w[interval + 1]) & 0xFFFFFFFF
+        a = ((a << 30) | (a >> 2)) & 0xFFFFFFFF
+        c = (c + (((d << 5) | (d >> 27)) & 0xFFFFFFFF) + (e ^ a ^ b) +
+             0xCA62C1D6 + w[interval + 2]) & 0xFFFFFFFF
+        e = ((e << 30) | (e >> 2)) & 0xFFFFFFFF
+        b = (b + (((c << 5) | (c >> 27)) & 0xFFFFFFFF) + (d ^ e ^ a) +
+             0xCA62C1D6 + w[interval + 3]) & 0xFFFFFFFF
+        d = ((d << 30) | (d >> 2)) & 0xFFFFFFFF
+        a = (a + (((b << 5) | (b >> 27)) & 0xFFFFFFFF) + (c ^ d ^ e) +
+             0xCA62C1D6 + w[interval + 4]) & 0xFFFFFFFF
+        c = ((c << 30) | (c >> 2)) & 0xFFFFFFFF
+
+    return ((sub_registers[0] + a) & 0xFFFFFFFF,
+            (sub_registers[1] + b) & 0xFFFFFFFF,
+            (sub_registers[2] + c) & 0xFFFFFFFF,
+            (sub_registers[3] + d) & 0xFFFFFFFF,
+            (sub_registers[4] + e) & 0xFFFFFFFF)
+
+def sha_1_file(path, chunk_size=CHUNK_BYTES):
+    """Evaluate to the 20 byte SHA-1 digest of a file, hashed one
+    memory mapped chunk at a time.
+    """
+    hash = SHA1()
+    for chunk, _ in mapped_chunks(path, chunk_size):
+        hash.update(chunk)
+    return hash.digest()
+
+def length_padding(length):
+    """SHA-1 padding for a message of length bytes: a 1 bit, zeroes,
+    then the 64-bit message length in bits.
+    """
+    return (b'\x80' + b'\x00' * ((55 - length) % BLOCK_BYTES) +
+            struct.pack('>Q', 8 * length))
+
+class SHA1(object):
+    """Incremental SHA-1 with a hashlib-style interface. Only the five
+    sub-registers, a partial block and the message length are kept, so
+    input of any size hashes in constant memory.
+    """
+
+    name = 'sha1'
+    digest_size = 20
+    block_size = BLOCK_BYTES
+
+    def __init__(self, data=b''):
+        """Start a new hash, optionally absorbing some initial data."""
+        self.sub_registers = INITIAL_REGISTERS
+        self.buffer = b''
+        self.length = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        """Absorb more bytes of the message. Any buffer (bytes,
+        bytearray, memoryview, mmap slice) is accepted.
+        """
+        data = memoryview(data).tobytes()
+        self.length += len(data)
+        if self.buffer:
+            needed = BLOCK_BYTES - len(self.buffer)
+            self.buffer += data[:needed]
+            data = data[needed:]
+            if len(self.buffer) < BLOCK_BYTES:
+                return
+            self.sub_registers = compress_block(self.sub_registers,
+                                                self.buffer)
+        sub_registers = self.sub_registers
+        end = len(data) - len(data) % BLOCK_BYTES
+        for index in xrange(0, end, BLOCK_BYTES):
+            sub_registers = compress_block(sub_registers,
+                                           data[index:index + BLOCK_BYTES])
+        self.sub_registers = sub_registers
+        self.buffer = data[end:]
+
+    def copy(self):
+        """Fork the hash state. The registers are an immutable tuple, so
+        this costs no more than the partial block.
+        """
+        other = type(self).__new__(type(self))
+        other.sub_registers = self.sub_registers
+        other.buffer = self.buffer
+        other.length = self.length
+        return other
+
+    def digest(self):
+        """Evaluate to the 20 byte hash of everything absorbed so far.
+        The message is padded with a 1 bit, zeroes, and its 64-bit
+        length without disturbing this object's state.
+        """
+        final = self.buffer + length_padding(self.length)
+        sub_registers = self.sub_registers
+        for index in xrange(0, len(final), BLOCK_BYTES):
+            sub_registers = compress_block(sub_registers,
+                                           final[index:index + BLOCK_BYTES])
+        return struct.pack('>5I', *sub_registers)
+
+    def hexdigest(self):
+        """Evaluate to the hash as a string of hexadecimal digits."""
+        return hexlify(self.digest())
+
+def constant_time_equal(bytes1, bytes2):
+    """Compare two byte strings without stopping at the first
+    difference, so the time taken doesn't reveal where they differ.
+    """
+    if len(bytes1) != len(bytes2):
+        return False
+    difference = 0
+    for byte1, byte2 in zip(bytearray(bytes1), bytearray(bytes2)):
+        difference |= byte1 ^ byte2
+    return difference == 0
+
+class HMACKey(object):
+    """HMAC-SHA1 for a fixed key. The key XOR ipad and key XOR opad
+    blocks are absorbed once into saved SHA1 states; each MAC then only
+    compresses the message blocks and one outer block. The saved states
+    are never updated in place, so a key can be shared between threads.
+    """
+
+    def __init__(self, key):
+        """Hash oversized keys, zero pad to a block and absorb the pads."""
+        key = memoryview(key).tobytes()
+        if len(key) > BLOCK_BYTES:
+            key = SHA1(key).digest()
+        key += b'\x00' * (BLOCK_BYTES - len(key))
+        self.inner = SHA1(bytes_xor(key, b'\x36' * BLOCK_BYTES))
+        self.outer = SHA1(bytes_xor(key, b'\x5c' * BLOCK_BYTES))
+
+    def mac(self, message):
+        """Evaluate to the 20 byte HMAC of a message."""
+        inner = self.inner.copy()
+        inner.update(message)
+        outer = self.outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
+
+    def hexmac(self, message):
+        """Evaluate to the HMAC as a string of hexadecimal digits."""
+        return hexlify(self.mac(message))
+
+    def verify(self, message, tag):
+        """Check a tag against the message's HMAC in constant time."""
+        return constant_time_equal(self.mac(message), tag)
+
+HMAC_KEY_CACHE = LRUCache(HMAC_KEY_CACHE_SIZE)
+
+def hmac_key(key):
+    """Find the HMACKey for a key, building it only if it isn't among
+    the HMAC_KEY_CACHE_SIZE most recently used keys.
+    """
+    return HMAC_KEY_CACHE.get(memoryview(key).tobytes(), HMACKey)
+
+def hmac_sha_1(key, message):
+    """Evaluate to the 20 byte HMAC-SHA1 of a message under a key."""
+    return hmac_key(key).mac(message)
+
+def rotate_lanes(lanes, amount):
+    """Rotate every uint32 lane of an array left by amount bits."""
+    return (lanes << amount) | (lanes >> (32 - amount))
+
+def compress_lanes(sub_registers, w):
+    """Vectorized compress_block. sub_registers holds five uint32 arrays
+    with one lane per message and w is a (16, n) array of block words.
+    """
+    w = list(w)
+    for interval in xrange(16, SHA_1_INTERVALS):
+        w.append(rotate_lanes(w[interval - 3] ^ w[interval - 8] ^
+                              w[interval - 14] ^ w[interval - 16], 1))
+    a, b, c, d, e = sub_registers
+    for interval in xrange(SHA_1_INTERVALS):
+        if interval < 20:
+            mixed = d ^ (b & (c ^ d))
+        elif interval < 40 or interval >= 60:
+            mixed = b ^ c ^ d
+        else:
+            mixed = (b & c) | (d & (b | c))
+        a, b, c, d, e = (rotate_lanes(a, 5) + mixed + e + w[interval] +
+                         np.uint32(ROUND_CONSTANTS[interval]),
+                         a, rotate_lanes(b, 30), c, d)
+    return [register + new for register, new
+            in zip(sub_registers, [a, b, c, d, e])]
+
+def sha_1_many(messages):
+    """Evaluate to the 20 byte SHA-1 digest of every message in a list.
+    Messages are grouped by padded block count and each group is
+    compressed in one pass, with a NumPy uint32 lane per message.
+    """
+    messages = [memoryview(message).tobytes() for message in messages]
+    groups = {}
+    for index, message in enumerate(messages):
+        padded = message + length_padding(len(message))
+        groups.setdefault(len(padded) // BLOCK_BYTES, []).append((index, padded))
+    digests = [None] * len(messages)
+    for number_of_blocks, members in groups.items():
+        words = np.frombuffer(b''.join(padded for _, padded in members),
+                              dtype='>u4').astype(np.uint32)
+        words = words.reshape(len(members), number_of_blocks, 16)
+        sub_registers = [np.full(len(members), register, dtype=np.uint32)
+                         for register in INITIAL_REGISTERS]
+        for block in xrange(number_of_blocks):
+            sub_registers = compress_lanes(sub_registers, words[:, block, :].T)
+        packed = np.stack(sub_registers, axis=1).astype('>u4').tobytes()
+        for place, (index, _) in enumerate(members):
+            digests[index] = packed[20 * place:20 * place + 20]
+    return digests
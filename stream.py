@@ -7,9 +7,18 @@ stream.py
 """
 
 import sys
+import struct
 import random
-from cryptography_utilities import (string_to_binary, file_to_binary,
-    binary_to_file)
+from cryptography_utilities import (string_to_binary, bytes_to_binary,
+    binary_to_bytes,
+    chunked_file_transform, run_pipeline, CHUNK_BYTES, bytes_xor,
+    int_to_bytes, word_mask, left_pad, decimal_to_binary, bytes_to_int,
+    BYTE_LENGTH)
+
+LEAP_BITS = 64
+
+# x^64 + x^63 + x^61 + x^60 + 1, a maximal length polynomial.
+DEFAULT_TAPS = [64, 63, 61, 60]
 
 def psuedo_random_register_fn(key):
     """Provide a register function that gives the next bit in the
@@ -19,11 +28,207 @@ def psuedo_random_register_fn(key):
     random.seed(key)
     def register_fn():
         return str(random.randint(0, 1))
+    def bits(count):
+        return int(''.join([str(random.randint(0, 1))
+                            for _ in xrange(count)]) or '0', 2)
+    register_fn.bits = bits
     return register_fn
 
+def parity(word):
+    """XOR all the bits of an integer together."""
+    return bin(word).count('1') & 1
+
+def byte_tables(columns):
+    """Precompute a GF(2) linear map one input byte at a time. The map
+    is given by its columns (the image of each input bit, least
+    significant first); table k maps the value of input byte k to the
+    XOR of the matching columns.
+    """
+    tables = []
+    for start in xrange(0, len(columns), BYTE_LENGTH):
+        byte_columns = columns[start:start + BYTE_LENGTH]
+        table = [0] * (1 << len(byte_columns))
+        for value in xrange(1, len(table)):
+            lowest = value & -value
+            table[value] = (table[value ^ lowest] ^
+                            byte_columns[lowest.bit_length() - 1])
+        tables.append(table)
+    return tables
+
+def apply_tables(tables, word):
+    """Apply a byte_tables linear map to an integer."""
+    result = 0
+    for table in tables:
+        result ^= table[word & 0xFF]
+        word >>= BYTE_LENGTH
+    return result
+
+class LFSR(object):
+    """A linear feedback shift register with its own state, usable as a
+    stream_cipher register_fn. Taps are polynomial exponents, e.g.
+    [16, 14, 13, 11] for x^16 + x^14 + x^13 + x^11 + 1; the largest is
+    the register length. Fibonacci registers feed the XOR of the tapped
+    bits back in, Galois registers XOR the output bit into the tapped
+    bits. Either way the bit shifted out is the output, and
+    LEAP_BITS steps can be taken at once through precomputed tables for
+    the state transition and output matrices.
+    """
+
+    def __init__(self, taps, state, galois=False):
+        """Set up a register of length max(taps) holding state (which
+        must not be zero).
+        """
+        self.size = max(taps)
+        self.galois = galois
+        if galois:
+            self.mask = sum(1 << (tap - 1) for tap in taps)
+        else:
+            self.mask = sum(1 << (self.size - tap) for tap in taps)
+        self.state = state & word_mask(self.size)
+        if not self.state:
+            raise ValueError('An LFSR state must not be all zeroes.')
+        self.buffer = self.buffered = 0
+        self.state_tables, self.output_tables = self.leap_tables()
+        self.leap_pairs = list(zip(self.state_tables, self.output_tables))
+
+    def step(self):
+        """Advance one bit and evaluate to the output bit."""
+        state = self.state
+        output = state & 1
+        if self.galois:
+            state >>= 1
+            if output:
+                state ^= self.mask
+        else:
+            state = (state >> 1) | (parity(state & self.mask) << (self.size - 1))
+        self.state = state
+        return output
+
+    def transition_columns(self, steps):
+        """Columns of the state transition and output matrices for a
+        number of steps, found by stepping each single-bit state. The
+        outputs are packed first bit most significant.
+        """
+        state = self.state
+        state_columns, output_columns = [], []
+        for place in xrange(self.size):
+            self.state = 1 << place
+            output = 0
+            for _ in xrange(steps):
+                output = (output << 1) | self.step()
+            state_columns.append(self.state)
+            output_columns.append(output)
+        self.state = state
+        return state_columns, output_columns
+
+    def leap_tables(self):
+        """Byte tables for the state after LEAP_BITS steps and for the
+        LEAP_BITS output bits.
+        """
+        state_columns, output_columns = self.transition_columns(LEAP_BITS)
+        return byte_tables(state_columns), byte_tables(output_columns)
+
+    def jump_tables(self, power):
+        """Byte tables for the state transition over 2^power steps,
+        built by repeatedly squaring the one step matrix and cached.
+        """
+        if not hasattr(self, 'jump_powers'):
+            self.jump_powers = [byte_tables(self.transition_columns(1)[0])]
+        while len(self.jump_powers) <= power:
+            tables = self.jump_powers[-1]
+            self.jump_powers.append(byte_tables(
+                [apply_tables(tables, apply_tables(tables, 1 << place))
+                 for place in xrange(self.size)]))
+        return self.jump_powers[power]
+
+    def jump(self, count):
+        """Skip count output bits in O(log count) matrix applications."""
+        if count <= self.buffered:
+            self.buffered -= count
+            self.buffer &= word_mask(self.buffered)
+            return
+        count -= self.buffered
+        self.buffer = self.buffered = 0
+        power = 0
+        while count:
+            if count & 1:
+                self.state = apply_tables(self.jump_tables(power), self.state)
+            count >>= 1
+            power += 1
+
+    def leap(self):
+        """Advance LEAP_BITS steps and evaluate to the output bits."""
+        state = self.state
+        new_state = output = 0
+        for state_table, output_table in self.leap_pairs:
+            byte = state & 0xFF
+            new_state ^= state_table[byte]
+            output ^= output_table[byte]
+            state >>= BYTE_LENGTH
+        self.state = new_state
+        return output
+
+    def bits(self, count):
+        """Evaluate to the next count output bits as an integer, first
+        bit most significant. Leftover bits of the last leap are kept
+        for the next call.
+        """
+        leaps = max(0, -(-(count - self.buffered) // LEAP_BITS))
+        buffer, buffered = self.buffer, self.buffered
+        if leaps:
+            leap = self.leap
+            words = [leap() for _ in xrange(leaps)]
+            buffer = ((buffer << (leaps * LEAP_BITS)) |
+                      bytes_to_int(struct.pack('>%dQ' % leaps, *words)))
+            buffered += leaps * LEAP_BITS
+        self.buffered = buffered - count
+        self.buffer = buffer & word_mask(self.buffered)
+        return buffer >> self.buffered
+
+    def __call__(self):
+        """Evaluate to the next output bit as a '0'/'1' character."""
+        return str(self.bits(1))
+
+def key_state(key, size):
+    """Fold a key's bytes into a nonzero starting state of size bits."""
+    value = bytes_to_int(key) if key else 0
+    state = 0
+    while value:
+        state ^= value & word_mask(size)
+        value >>= size
+    return state or 1
+
+def fibonacci_register_fn(key, taps=DEFAULT_TAPS):
+    """Provide a register function backed by a Fibonacci LFSR seeded
+    from the key. Unlike psuedo_random_register_fn, it leaves the
+    global random module alone.
+    """
+    return LFSR(taps, key_state(key, max(taps)))
+
+def galois_register_fn(key, taps=DEFAULT_TAPS):
+    """Provide a register function backed by a Galois LFSR seeded from
+    the key.
+    """
+    return LFSR(taps, key_state(key, max(taps)), galois=True)
+
+# Register function constructors, by name, for the command line and
+# batch.py. Ciphertext can only be decrypted with the register it was
+# encrypted with.
+REGISTER_FUNCTIONS = {'psuedo_random': psuedo_random_register_fn,
+                      'fibonacci': fibonacci_register_fn,
+                      'galois': galois_register_fn}
+
+DEFAULT_REGISTER = 'psuedo_random'
+
+def make_register_fn(key, register=DEFAULT_REGISTER):
+    """Build the named register function for a key."""
+    if register not in REGISTER_FUNCTIONS:
+        raise ValueError('Unknown register: {}'.format(register))
+    return REGISTER_FUNCTIONS[register](key)
+
 def xor_combiner(binary):
     """Collapse a sequence of bits into a single bit by XOR."""
-    return '1' if reduce(lambda x, y: x != y, binary) else '0'
+    return '1' if binary.count('1') % 2 else '0'
 
 def setup_register(key, register_fn, size=50):
     """Generate an initial register with the key. If the key doesn't
@@ -40,6 +245,84 @@ def update_register(register, register_fn):
     """Nondestructively advance the bit register."""
     return register[1:] + [register_fn()]
 
+def register_bits(register_fn, count):
+    """Draw the next count bits from a register function as an integer,
+    first bit most significant. Register functions may provide a
+    bits(count) method to do this faster than count single calls.
+    """
+    if hasattr(register_fn, 'bits'):
+        return register_fn.bits(count)
+    return int(''.join([register_fn() for _ in xrange(count)]) or '0', 2)
+
+class Keystream(object):
+    """The xor_combiner keystream of stream_cipher, produced many bits
+    at a time. The register is an integer and its parity is carried
+    along: each step only changes it by the bit dropped off the front
+    and the bit added at the back.
+    """
+
+    def __init__(self, key, register_fn, size=50):
+        """Set up the register exactly as stream_cipher does."""
+        register = setup_register(key, register_fn, size)
+        self.width = len(register)
+        self.register = int(''.join(register), 2)
+        self.parity = register.count('1') % 2
+        self.register_fn = register_fn
+
+    def next_bits(self, count):
+        """Advance count steps and evaluate to the keystream bits as an
+        integer (first bit most significant).
+        """
+        if count == 0:
+            return 0
+        added = register_bits(self.register_fn, count)
+        combined = (self.register << count) | added
+        dropped = combined >> self.width
+        self.register = combined & word_mask(self.width)
+        # Bit i of the keystream is the starting parity XOR every
+        # (dropped ^ added) bit up to i: a prefix XOR, in log2 steps.
+        stream = dropped ^ added
+        shift = 1
+        while shift < count:
+            stream ^= stream >> shift
+            shift <<= 1
+        if self.parity:
+            stream ^= word_mask(count)
+        self.parity = stream & 1
+        return stream
+
+    def skip(self, count):
+        """Advance count steps without producing keystream. Only the
+        last width bits drawn matter to the register (and its parity),
+        so everything before them is skipped with skip_register_bits.
+        """
+        if count >= self.width:
+            skip_register_bits(self.register_fn, count - self.width)
+            self.register = register_bits(self.register_fn, self.width)
+        elif count:
+            added = register_bits(self.register_fn, count)
+            self.register = (((self.register << count) | added) &
+                             word_mask(self.width))
+        self.parity = parity(self.register)
+
+    def crypt(self, data):
+        """Encrypt or decrypt the next len(data) bytes of a message."""
+        data = memoryview(data).tobytes()
+        return bytes_xor(data, int_to_bytes(self.next_bits(8 * len(data)),
+                                            len(data)))
+
+def skip_register_bits(register_fn, count):
+    """Discard the next count bits of a register function, jumping if
+    it supports jump(count) and drawing them a chunk at a time if not.
+    """
+    if hasattr(register_fn, 'jump'):
+        register_fn.jump(count)
+        return
+    while count:
+        step = min(count, 8 * CHUNK_BYTES)
+        register_bits(register_fn, step)
+        count -= step
+
 def stream_cipher(binary_text, key, combiner_fn, register_fn):
     """Encrypt or decrypt a binary string of text by combining a
     maintained register with each successive bit of binary_text.
@@ -49,22 +332,79 @@ def stream_cipher(binary_text, key, combiner_fn, register_fn):
     :param combiner_fn: takes the register and outputs a single bit
     :param register_fn: gives the next bit in the keystream
     """
+    if combiner_fn is xor_combiner:
+        if not binary_text:
+            return ''
+        keystream = Keystream(key, register_fn).next_bits(len(binary_text))
+        return left_pad(decimal_to_binary(int(binary_text, 2) ^ keystream),
+                        len(binary_text))
     register = setup_register(key, register_fn)
-    output = ''
+    output = []
     for bit in binary_text:
         register = update_register(register, register_fn)
-        output += '1' if combiner_fn(register) != bit else '0'
-    return output
+        output.append('1' if combiner_fn(register) != bit else '0')
+    return ''.join(output)
+
+def stream_cipher_chunks(key, combiner_fn, register_fn):
+    """Chunked form of stream_cipher. Evaluates to a function that
+    encrypts or decrypts successive byte chunks of one message, carrying
+    the register over from each chunk to the next.
+    """
+    if combiner_fn is xor_combiner:
+        keystream = Keystream(key, register_fn)
+        return lambda chunk, is_last=False: keystream.crypt(chunk)
+    state = {'register': setup_register(key, register_fn)}
+
+    def transform(chunk, is_last=False):
+        register = state['register']
+        output = []
+        for bit in bytes_to_binary(memoryview(chunk).tobytes()):
+            register = update_register(register, register_fn)
+            output.append('1' if combiner_fn(register) != bit else '0')
+        state['register'] = register
+        return binary_to_bytes(''.join(output))
+    return transform
+
+def decrypt_range(ciphertext, key, start, end, register_fn=None):
+    """Decrypt bytes start..end of a message encrypted with xor_combiner
+    and the given register function, which defaults to the same
+    make_register_fn(key) the encrypt entry points use. With an LFSR
+    (fibonacci or galois) the keystream before start is jumped over in
+    logarithmic time; other register functions have to generate it.
+    """
+    if register_fn is None:
+        register_fn = make_register_fn(key)
+    keystream = Keystream(key, register_fn)
+    keystream.skip(BYTE_LENGTH * start)
+    return keystream.crypt(ciphertext[start:end])
+
+def stream_cipher_file(input_path, output_path, key, chunk_size=CHUNK_BYTES,
+                       register=DEFAULT_REGISTER):
+    """Encrypt or decrypt a file with the stream cipher one memory
+    mapped chunk at a time. register names the register function; use
+    an LFSR to allow fast decrypt_range access.
+    """
+    transform = stream_cipher_chunks(key, xor_combiner,
+                                     make_register_fn(key, register))
+    chunked_file_transform(input_path, output_path, transform, chunk_size)
 
 def main(args):
-    if len(args) != 4:
-        print ('usage: {} <key> <input_file> <output_file>').format(args[0])
+    report = '--report' in args
+    args = [arg for arg in args if arg != '--report']
+    register = DEFAULT_REGISTER
+    if '--register' in args:
+        place = args.index('--register')
+        register = args[place + 1] if place + 1 < len(args) else None
+        del args[place:place + 2]
+    if len(args) != 4 or register not in REGISTER_FUNCTIONS:
+        print ('usage: {} <key> <input_file|-> <output_file|-> [--report] '
+               '[--register <{}>]').format(
+                   args[0], '|'.join(sorted(REGISTER_FUNCTIONS)))
         return 1
     _, key, input_file, output_file = args
-    binary_input = file_to_binary(input_file)
-    converted_text = stream_cipher(binary_input, key, xor_combiner,
-                                   psuedo_random_register_fn(key))
-    binary_to_file(converted_text, output_file)
+    transform = stream_cipher_chunks(key, xor_combiner,
+                                     make_register_fn(key, register))
+    run_pipeline(input_file, output_file, transform, report=report)
 
 if __name__ == '__main__':
     main(sys.argv)